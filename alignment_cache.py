@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional
+from gene_classes import BioPythonAligner
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'sequence_analysis')
+
+
+def alignment_key(seq1: str, seq2: str, method: str, scoring: Dict, **options) -> str:
+    """Cache key from the content of both sequences, the method and every scoring parameter"""
+    parameters = json.dumps({'method': method, 'scoring': scoring, 'options': options}, sort_keys=True)
+    digest = hashlib.sha256()
+    for part in (seq1, seq2, parameters):
+        digest.update(hashlib.sha256(part.encode()).digest())
+    return digest.hexdigest()
+
+
+class AlignmentCache:
+    """Two-tier memo of alignment results: an in-memory LRU in front of a sqlite file that survives restarts"""
+
+    def __init__(self, cache_dir: Optional[str] = DEFAULT_CACHE_DIR, max_entries: int = 128):
+        self.max_entries = max_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # cache_dir=None keeps results in memory only
+        self.db_path = None
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.db_path = os.path.join(cache_dir, 'alignments.sqlite')
+            with self._connect() as db:
+                db.execute('CREATE TABLE IF NOT EXISTS alignments (key TEXT PRIMARY KEY, result BLOB NOT NULL)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per call, the app reads and writes from several session threads
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'memory_entries': len(self._entries)
+        }
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            if key in self._entries:
+                self.memory_hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        if self.db_path is not None:
+            with self._connect() as db:
+                row = db.execute('SELECT result FROM alignments WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                result = json.loads(zlib.decompress(row[0]))
+                with self._lock:
+                    self.disk_hits += 1
+                self._remember(key, result)
+                return result
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, result: Dict):
+        self._remember(key, result)
+        if self.db_path is not None:
+            with self._connect() as db:
+                db.execute(
+                    'INSERT OR REPLACE INTO alignments (key, result) VALUES (?, ?)',
+                    (key, zlib.compress(json.dumps(result).encode()))
+                )
+
+    def _remember(self, key: str, result: Dict):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def align_sequences(self, aligner: BioPythonAligner, seq1: str, seq2: str,
+                        method: str = 'global', **options) -> Dict:
+        """BioPythonAligner.align_sequences, answered from the cache when the same alignment was done before"""
+        key = alignment_key(seq1, seq2, method, aligner.scoring(), **options)
+        result = self.get(key)
+        if result is None:
+            result = aligner.align_sequences(seq1, seq2, method, **options)
+            self.put(key, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.db_path is not None:
+            with self._connect() as db:
+                db.execute('DELETE FROM alignments')
@@ -1,15 +1,28 @@
+import html
+import json
 import streamlit as st
 import pandas as pd
-from io import StringIO
 from fasta_parser import FastaParser, detect_sequence_type
-from gene_classes import DNASequence, AmminoacidsSequence, BioPythonAligner
+from composition import composition_table, gc_profile, downsample_profile
+from motif_search import MotifSearcher
+from dataset_cache import DatasetCache, content_hash
+from alignment_cache import AlignmentCache, alignment_key
+from jobs import JobManager, QUEUED, RUNNING, DONE, FAILED, CANCELLED, FINISHED_STATES, align_task, approximate_motif_task, motif_index_task, sketch_task
+from instrumentation import instrumented, registry, enable, disable, is_enabled
+from gene_classes import DNASequence, RNASequence, AmminoacidsSequence, BioPythonAligner
 import plotly.express as px
 import plotly.graph_objects as go
 
 st.set_page_config(page_title="Sequence Analysis", layout="wide")
 
+@instrumented
+def plot_chart(fig, **kwargs):
+    """st.plotly_chart, timed on its own so Plotly serialization shows up apart from the page"""
+    st.plotly_chart(fig, **kwargs)
+
+@instrumented
 def show_dna_analysis(sequence: DNASequence):
-    """Show DNA-specific analysis"""
+    """Show DNA-specific analysis, also used for RNA"""
     col1, col2 = st.columns(2)
     
     with col1:
@@ -38,7 +51,7 @@ def show_dna_analysis(sequence: DNASequence):
             bargap=0.3,
             height=400
         )
-        st.plotly_chart(fig_abs, use_container_width=True)
+        plot_chart(fig_abs, use_container_width=True)
         
     with col2:
         fig_pct = go.Figure(data=[
@@ -56,8 +69,57 @@ def show_dna_analysis(sequence: DNASequence):
             height=400,
             yaxis=dict(range=[0, 100])
         )
-        st.plotly_chart(fig_pct, use_container_width=True)
+        plot_chart(fig_pct, use_container_width=True)
+    
+    show_gc_profile(sequence)
+
+#points sent to the browser per profile chart, longer profiles are reduced on the server
+MAX_PROFILE_POINTS = 2000
+
+@instrumented
+def show_gc_profile(sequence: DNASequence):
+    """Sliding-window GC content and GC/AT skew along the sequence"""
+    st.subheader("GC Profile")
+    length = sequence.sequence_length()
+    if length == 0:
+        st.info("The sequence is empty")
+        return
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        window = st.number_input("Window size (bases)", min_value=1, max_value=length,
+                                 value=min(length, max(100, length // 100)), key='gc_window')
+    with col2:
+        step = st.number_input("Step (bases)", min_value=1, value=max(1, window // 5), key='gc_step')
+    
+    profile = gc_profile(sequence.sequence, int(window), int(step))
+    reduced = downsample_profile(profile, MAX_PROFILE_POINTS)
+    position = (reduced['start'] + reduced['end']) / 2
+    if len(reduced) < len(profile):
+        st.caption(f"{len(profile):,} windows shown as {len(reduced):,} points, shaded bands are the min-max of each point")
+    
+    def add_metric(fig, column, name, color):
+        if f'{column}_min' in reduced:
+            fig.add_trace(go.Scatter(x=position, y=reduced[f'{column}_max'], mode='lines', line=dict(width=0),
+                                     showlegend=False, hoverinfo='skip'))
+            fig.add_trace(go.Scatter(x=position, y=reduced[f'{column}_min'], mode='lines', line=dict(width=0),
+                                     fill='tonexty', fillcolor=color.replace('rgb', 'rgba').replace(')', ', 0.2)'),
+                                     showlegend=False, hoverinfo='skip'))
+        fig.add_trace(go.Scatter(x=position, y=reduced[column], mode='lines', name=name, line=dict(color=color)))
+    
+    fig_gc = go.Figure()
+    add_metric(fig_gc, 'GC_percentage', "GC %", 'rgb(102, 178, 255)')
+    fig_gc.update_layout(title="GC Content (%)", xaxis_title="Position", yaxis_title="Percentage", height=350)
+    plot_chart(fig_gc, use_container_width=True)
+    
+    fig_skew = go.Figure()
+    add_metric(fig_skew, 'GC_skew', "GC skew (G-C)/(G+C)", 'rgb(255, 153, 153)')
+    add_metric(fig_skew, 'AT_skew', "AT skew (A-T)/(A+T)", 'rgb(153, 204, 102)')
+    fig_skew.update_layout(title="GC and AT Skew", xaxis_title="Position", yaxis_title="Skew", height=350,
+                           yaxis=dict(range=[-1, 1]))
+    plot_chart(fig_skew, use_container_width=True)
 
+@instrumented
 def show_protein_analysis(sequence: AmminoacidsSequence):
     """Show protein-specific analysis"""
     st.metric("Sequence Length", sequence.sequence_length())
@@ -83,7 +145,7 @@ def show_protein_analysis(sequence: AmminoacidsSequence):
             bargap=0.3,
             height=400
         )
-        st.plotly_chart(fig_abs, use_container_width=True)
+        plot_chart(fig_abs, use_container_width=True)
         
     with col2:
         fig_pct = go.Figure(data=[
@@ -101,7 +163,144 @@ def show_protein_analysis(sequence: AmminoacidsSequence):
             height=400,
             yaxis=dict(range=[0, 100])
         )
-        st.plotly_chart(fig_pct, use_container_width=True)
+        plot_chart(fig_pct, use_container_width=True)
+
+@st.cache_resource
+def get_dataset_cache() -> DatasetCache:
+    """One dataset cache shared by every session"""
+    return DatasetCache()
+
+@st.cache_resource
+def get_alignment_cache() -> AlignmentCache:
+    """Alignment results shared by every session and kept on disk between restarts"""
+    return AlignmentCache()
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """Process pool shared by every session for analyses too long to run inside a page"""
+    return JobManager()
+
+#work above these sizes goes to a background job instead of blocking the page
+INLINE_ALIGNMENT_CELLS = 25_000_000
+#seeded pairs up to this total length are chained on the page to measure their gaps, longer ones go to a job
+INLINE_SEEDED_BASES = 500_000
+INLINE_MOTIF_BASES = 5_000_000
+
+def background_result(key: str, name: str, task, *args, on_done=None):
+    """Result of task(*args) run as a background job under key, None while it is not done
+
+    Until then the job's progress is shown with a cancel button, and the page reruns when it finishes.
+    """
+    jobs = get_job_manager()
+    job_id = jobs.find(key)
+    try:
+        if job_id is None:
+            job_id = jobs.submit(task, *args, key=key, name=name, on_done=on_done)
+        status = jobs.status(job_id)
+        if status['state'] in (FAILED, CANCELLED):
+            st.warning(f"{name}: {status['error'] or status['state']}")
+            if not st.button("Run again", key=f"retry_{job_id}"):
+                return None
+            job_id = jobs.submit(task, *args, key=key, name=name, on_done=on_done)
+    except RuntimeError as e:
+        st.warning(str(e))
+        return None
+    
+    if jobs.status(job_id)['state'] == DONE:
+        return jobs.result(job_id)
+    show_job_progress(job_id)
+    return None
+
+@st.fragment(run_every=1.0)
+def show_job_progress(job_id: str):
+    """Polls the job every second without rerunning the rest of the page"""
+    jobs = get_job_manager()
+    status = jobs.status(job_id)
+    if status['state'] in FINISHED_STATES:
+        st.rerun()
+    
+    if status['state'] == QUEUED:
+        text = f"{status['name']}: waiting for a free worker"
+    elif status['total']:
+        text = f"{status['name']}: {status['done']:,} of {status['total']:,} steps, {status['elapsed']:.0f} s"
+    else:
+        text = f"{status['name']}: running for {status['elapsed']:.0f} s"
+    st.progress(status['fraction'], text=text)
+    st.caption("Runs in the background, you can keep using the other pages")
+    if status['cancel_requested']:
+        st.caption("Cancelling...")
+    elif st.button("Cancel", key=f"cancel_{job_id}"):
+        jobs.cancel(job_id)
+
+def show_jobs():
+    for status in get_job_manager().jobs():
+        progress = f"{status['fraction']:.0%}" if status['state'] == RUNNING and status['total'] else ''
+        st.write(f"`{status['job_id']}` {status['name']}: {status['state']} {progress}")
+
+@instrumented
+def build_dataset(data) -> tuple:
+    """Parse an upload and derive everything the pages need, returns (dataset, size in bytes)"""
+    # parsed straight from the upload buffer, no decoding copy and no temp file
+    df = FastaParser.parse_bytes(data)
+    dataset = {
+        'data': df,
+        'sequence_type': detect_sequence_type(df),
+        'sequence_objects': FastaParser.create_sequence_collection(df),
+        # every record is counted against its own alphabet, mixed files included
+        'composition': composition_table(df),
+        # built by the motif and alignment pages on first use
+        'motif_index': None,
+        'sketches': None
+    }
+    return dataset, int(df.memory_usage(deep=True).sum())
+
+def dna_subset(dataset):
+    """The DNA records of a dataset, indexes and k-mer sketches only make sense for them"""
+    sequence_types = dataset['sequence_objects'].sequence_types
+    return dataset['sequence_objects'].select(sequence_types.index[sequence_types == "DNA"].tolist())
+
+def background_derived(name: str, task, label: str):
+    """dataset[name] built by task over the DNA records in a background job, None until it is ready
+
+    The finished object is attached to the cached dataset and counted in the size of its entry.
+    """
+    dataset = st.session_state.dataset
+    if dataset.get(name) is not None:
+        return dataset[name]
+    
+    cache = get_dataset_cache()
+    dataset_key = st.session_state.dataset_key
+    def attach(value):
+        return cache.attach(dataset_key, dataset, name, lambda: (value, value.nbytes))
+    
+    manager = get_job_manager()
+    key = f"{name}:{dataset_key}"
+    job_id = manager.find(key)
+    if job_id is None or manager.status(job_id)['state'] in (FAILED, CANCELLED):
+        records = dna_subset(dataset)
+        try:
+            job_id = manager.submit(
+                task,
+                list(zip(records.sequence_ids, records.sequences)),
+                key=key,
+                name=f"{label} of {len(records)} sequences",
+                on_done=attach
+            )
+        except RuntimeError:
+            # the queue is full, the page does without it and the next rerun asks again
+            return None
+    
+    # a job finished for an earlier copy of this dataset, e.g. before it was evicted and parsed again
+    value = manager.result(job_id)
+    return attach(value) if value is not None else None
+
+def motif_index():
+    """The suffix array of the dataset's DNA records, None while a background job builds it"""
+    return background_derived('motif_index', motif_index_task, "motif index")
+
+def minhash_sketches():
+    """MinHash sketches of the dataset's DNA records, None while a background job builds them"""
+    return background_derived('sketches', sketch_task, "MinHash sketches")
 
 def main():
     st.title("Sequence Analysis Tool")
@@ -114,25 +313,44 @@ def main():
     
     # Initialize session state
     if 'data' not in st.session_state:
+        st.session_state.dataset = None
         st.session_state.data = None
         st.session_state.sequence_objects = None
         st.session_state.sequence_type = None
+        st.session_state.composition = None
+    
+    # Stage timings, switched on from the sidebar before any page runs
+    metrics_panel = st.sidebar.expander("Performance metrics")
+    with metrics_panel:
+        if st.checkbox("Record stage timings", value=is_enabled(), key='metrics_enabled'):
+            enable(trace_memory=st.checkbox("Trace peak memory", value=True, key='metrics_memory'))
+        else:
+            disable()
     
     # File uploader
-    uploaded_file = st.sidebar.file_uploader("Upload FASTA file", type=['txt', 'fasta'])
+    uploaded_file = st.sidebar.file_uploader("Upload FASTA file", type=['txt', 'fasta', 'fa', 'gz', 'bgz'])
     if uploaded_file is not None:
         try:
-            stringio = StringIO(uploaded_file.getvalue().decode("utf-8"))
-            with open("temp_fasta.txt", "w") as f:
-                f.write(stringio.read())
+            # the upload is hashed once, later reruns reuse its key
+            if st.session_state.get('dataset_file') != uploaded_file.file_id:
+                with uploaded_file.getbuffer() as buffer:
+                    st.session_state.dataset_key = content_hash(buffer)
+                st.session_state.dataset_file = uploaded_file.file_id
             
-            # Parse file and create sequence objects
-            st.session_state.data = FastaParser.parse_file("temp_fasta.txt")
-            st.session_state.sequence_type = detect_sequence_type(st.session_state.data)
-            st.session_state.sequence_objects = FastaParser.create_sequence_objects(st.session_state.data)
+            with uploaded_file.getbuffer() as buffer:
+                dataset = get_dataset_cache().get_or_build(
+                    st.session_state.dataset_key,
+                    lambda: build_dataset(buffer)
+                )
+            st.session_state.dataset = dataset
+            st.session_state.data = dataset['data']
+            st.session_state.sequence_type = dataset['sequence_type']
+            st.session_state.sequence_objects = dataset['sequence_objects']
+            st.session_state.composition = dataset['composition']
             
             # Show sequence type in sidebar
-            st.sidebar.success(f"Detected {st.session_state.sequence_type} sequences")
+            sequence_types = ', '.join(st.session_state.data['sequence_type'].unique())
+            st.sidebar.success(f"Detected {sequence_types} sequences")
             
         except Exception as e:
             st.error(f"Error parsing file: {str(e)}")
@@ -146,7 +364,32 @@ def main():
         show_motif_analysis()
     elif page == "Sequence Alignment":
         show_sequence_alignment()
+    
+    if is_enabled():
+        with metrics_panel:
+            show_metrics()
+    
+    if get_job_manager().jobs():
+        with st.sidebar.expander("Background jobs"):
+            show_jobs()
+
+def show_metrics():
+    metrics = registry.snapshot()
+    if not metrics:
+        st.caption("Nothing recorded yet")
+    else:
+        table = pd.DataFrame(metrics).set_index('stage')
+        table['peak_MiB'] = table['peak_bytes'] / 2 ** 20
+        st.dataframe(table[['calls', 'total_seconds', 'mean_seconds', 'max_seconds', 'peak_MiB']].round(4))
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Export JSON", registry.to_json(), file_name="stage_metrics.json", mime="application/json")
+    with col2:
+        if st.button("Reset", key='metrics_reset'):
+            registry.reset()
 
+@instrumented
 def show_overview():
     st.header("Dataset Overview")
     
@@ -157,27 +400,33 @@ def show_overview():
         
         with col1:
             st.metric("Number of Sequences", len(st.session_state.data))
+        composition = st.session_state.composition
         with col2:
-            avg_length = sum(len(obj.sequence) for obj in st.session_state.sequence_objects) / len(st.session_state.sequence_objects)
+            avg_length = composition['length'].mean()
             st.metric("Average Sequence Length", f"{avg_length:,.0f}")
         
         # Length distribution
-        lengths = [obj.sequence_length() for obj in st.session_state.sequence_objects]
+        lengths = composition['length']
         fig = px.histogram(
             x=lengths,
             title="Distribution of Sequence Lengths",
             labels={'x': 'Sequence Length', 'y': 'Count'}
         )
-        st.plotly_chart(fig)
+        plot_chart(fig)
         
         # Data table
         st.subheader("Sequences in Dataset")
         df_display = st.session_state.data.copy()
         df_display['Sequence Length'] = lengths
         st.dataframe(df_display)
+        
+        # Composition of every sequence, computed in one pass over the dataset
+        st.subheader("Composition")
+        st.dataframe(composition.drop(columns='length'))
     else:
         st.info("Please upload a FASTA file to begin analysis")
 
+@instrumented
 def show_sequence_analysis():
     st.header("Sequence Analysis")
     
@@ -185,13 +434,13 @@ def show_sequence_analysis():
         # Select sequence
         selected_seq = st.selectbox(
             "Select Sequence to Analyze",
-            [obj.sequence_id for obj in st.session_state.sequence_objects]
+            st.session_state.sequence_objects.sequence_ids
         )
         
-        sequence = next(obj for obj in st.session_state.sequence_objects if obj.sequence_id == selected_seq)
+        sequence = st.session_state.sequence_objects[selected_seq]
         
         # Show appropriate analysis based on sequence type
-        if isinstance(sequence, DNASequence):
+        if isinstance(sequence, (DNASequence, RNASequence)):
             show_dna_analysis(sequence)
         else:
             show_protein_analysis(sequence)
@@ -210,37 +459,116 @@ def show_sequence_analysis():
     else:
         st.info("Please upload a FASTA file to begin analysis")
 
+@instrumented
 def show_motif_analysis():
     st.header("Motif Analysis")
     
     if st.session_state.sequence_objects:
         col1, col2 = st.columns([1, 2])
+        # records are searched by their own type, a mixed file holds both
+        sequence_types = st.session_state.sequence_objects.sequence_types
         
         with col1:
             # Default motif based on sequence type
-            default_motif = "ATCG" if st.session_state.sequence_type == "DNA" else "KR"
-            motif = st.text_input(
-                "Enter motif sequence to search",
+            default_motif = "ATCG" if (sequence_types == "DNA").any() else "KR"
+            motif_input = st.text_input(
+                "Enter motif sequences to search",
                 value=default_motif,
-                help="Enter a sequence motif to search for"
+                help="Enter one or more motifs separated by commas, DNA motifs may use IUPAC codes (N, R, Y, ...)"
             ).upper()
+            motifs = [m.strip() for m in motif_input.split(',') if m.strip()]
+            
+            max_errors = st.number_input(
+                "Allowed errors",
+                min_value=0,
+                max_value=5,
+                value=0,
+                help="Report approximate occurrences within this many mismatches or edits"
+            )
+            edits = max_errors > 0 and st.radio("Error model", ['mismatches', 'edits'], horizontal=True) == 'edits'
+            
+            both_strands = False
+            if (sequence_types == "DNA").any() and max_errors == 0:
+                both_strands = st.checkbox("Search both strands", value=True)
             
             selected_seqs = st.multiselect(
                 "Select Sequences to Analyze",
-                [obj.sequence_id for obj in st.session_state.sequence_objects],
-                default=[obj.sequence_id for obj in st.session_state.sequence_objects][:2]
+                st.session_state.sequence_objects.sequence_ids,
+                default=st.session_state.sequence_objects.sequence_ids[:2]
             )
         
-        if motif and selected_seqs:
-            results = []
-            for seq_id in selected_seqs:
-                sequence = next(obj for obj in st.session_state.sequence_objects if obj.sequence_id == seq_id)
-                positions = sequence.find_motif(motif)
-                results.append({
-                    'sequence_id': seq_id,
-                    'occurrences': len(positions),
-                    'positions': positions
-                })
+        if motifs and selected_seqs:
+            selected_objects = st.session_state.sequence_objects.select(selected_seqs)
+            
+            try:
+                total_bases = int(selected_objects.lengths.sum()) * len(motifs)
+                if max_errors > 0 and total_bases > INLINE_MOTIF_BASES:
+                    # long searches run as a job, the same query later finds it by key
+                    key = content_hash(json.dumps(
+                        [st.session_state.dataset_key, selected_seqs, motifs, max_errors, edits]
+                    ).encode())
+                    with col2:
+                        rows = background_result(
+                            key,
+                            f"{'edit' if edits else 'mismatch'} search of {len(motifs)} motifs",
+                            approximate_motif_task,
+                            list(zip(selected_seqs, selected_objects.sequences, selected_objects.sequence_types)),
+                            motifs,
+                            max_errors,
+                            edits
+                        )
+                    if rows is None:
+                        return
+                    results = pd.DataFrame(rows)
+                elif max_errors > 0:
+                    results = pd.DataFrame([
+                        {
+                            'sequence_id': obj.sequence_id,
+                            'motif': motif,
+                            'strand': '+',
+                            'occurrences': len(hits),
+                            'positions': [start for start, _, _ in hits]
+                        }
+                        for obj in selected_objects
+                        for motif in motifs
+                        for hits in [obj.find_approximate_motif(motif, max_errors, edits=edits)]
+                    ])
+                else:
+                    selected_types = sequence_types.loc[selected_seqs]
+                    dna_ids = selected_types.index[selected_types == "DNA"].tolist()
+                    other_ids = selected_types.index[selected_types != "DNA"].tolist()
+                    frames = []
+                    if dna_ids:
+                        # the suffix array is built by a background job on the first query, until it is ready
+                        # every search scans the selected sequences with an Aho-Corasick automaton
+                        index = motif_index()
+                        if index is not None:
+                            frames.append(index.search_many(motifs, dna_ids, both_strands=both_strands))
+                        else:
+                            frames.append(MotifSearcher(motifs, both_strands).search_many(selected_objects.select(dna_ids)))
+                            with col2:
+                                st.caption("The motif index is being built in the background, later searches will use it")
+                    if other_ids:
+                        frames.append(pd.DataFrame([
+                            {
+                                'sequence_id': obj.sequence_id,
+                                'motif': motif,
+                                'strand': '+',
+                                'occurrences': len(positions),
+                                'positions': positions
+                            }
+                            for obj in selected_objects.select(other_ids)
+                            for motif in motifs
+                            for positions in [obj.find_motif(motif)]
+                        ]))
+                    # back in the order the sequences were selected
+                    order = {sequence_id: i for i, sequence_id in enumerate(selected_seqs)}
+                    results = pd.concat(frames, ignore_index=True).sort_values(
+                        'sequence_id', key=lambda ids: ids.map(order), kind='stable'
+                    )
+            except ValueError as e:
+                st.error(f"Invalid motif: {str(e)}")
+                return
             
             with col2:
                 st.subheader("Motif Analysis Results")
@@ -249,20 +577,81 @@ def show_motif_analysis():
                     results,
                     x='sequence_id',
                     y='occurrences',
-                    title=f"Occurrences of motif '{motif}'",
+                    color='motif',
+                    pattern_shape='strand',
+                    barmode='group',
+                    title=f"Occurrences of motifs {', '.join(motifs)}",
                     labels={'sequence_id': 'Sequence', 'occurrences': 'Number of Occurrences'}
                 )
-                st.plotly_chart(fig)
+                plot_chart(fig)
                 
-                for result in results:
-                    with st.expander(f"Positions in {result['sequence_id']}"):
-                        if result['positions']:
-                            st.write(f"Found at positions: {', '.join(map(str, result['positions']))}")
-                        else:
-                            st.write("No occurrences found")
+                for seq_id, seq_results in results.groupby('sequence_id', sort=False):
+                    with st.expander(f"Positions in {seq_id}"):
+                        for result in seq_results.itertuples():
+                            if result.occurrences:
+                                st.write(f"{result.motif} ({result.strand}) found at positions: {', '.join(map(str, result.positions))}")
+                            else:
+                                st.write(f"{result.motif} ({result.strand}): no occurrences found")
     else:
         st.info("Please upload a FASTA file to begin analysis")
 
+@instrumented
+def show_similar_sequences(sequence_id: str):
+    """MinHash screen of the dataset, points at the pairs worth aligning"""
+    sketches = minhash_sketches()
+    if sketches is None:
+        st.caption("Sketching the dataset in the background, the most similar sequences show up when it is done")
+        return
+    nearest = sketches.nearest(sequence_id, top=5)
+    st.caption(f"Most similar to {sequence_id} (MinHash estimate)")
+    st.dataframe(
+        nearest[['sequence_id', 'jaccard', 'mash_distance']].round(4),
+        hide_index=True,
+        use_container_width=True
+    )
+
+#columns per line of the alignment view
+ALIGNMENT_LINE_WIDTH = 60
+
+ALIGNMENT_STYLE = """
+<style>
+.alignment-block {
+    font-family: monospace;
+    white-space: pre;
+    padding: 10px;
+    margin: 10px 0;
+    background-color: #f5f5f5;
+    border-radius: 5px;
+}
+.position-header {
+    color: #666;
+    font-size: 0.9em;
+    margin-bottom: 5px;
+}
+.sequence {
+    color: #1a1a1a;
+}
+.match-line {
+    color: #0066cc;
+}
+</style>
+"""
+
+def render_alignment_blocks(blocks) -> str:
+    """The style and every block as one HTML string, sent to the browser in a single element"""
+    parts = [ALIGNMENT_STYLE]
+    for block in blocks:
+        parts.append(
+            '<div class="alignment-block">'
+            f'<div class="position-header">Position {block["position"]}</div>'
+            f'<div class="sequence">{html.escape(block["seq1"])}</div>'
+            f'<div class="match-line">{block["match"]}</div>'
+            f'<div class="sequence">{html.escape(block["seq2"])}</div>'
+            '</div>'
+        )
+    return ''.join(parts)
+
+@instrumented
 def show_sequence_alignment():
     st.header("Sequence Alignment")
     
@@ -272,33 +661,68 @@ def show_sequence_alignment():
         with col1:
             seq1_id = st.selectbox(
                 "Select First Sequence",
-                [obj.sequence_id for obj in st.session_state.sequence_objects],
+                st.session_state.sequence_objects.sequence_ids,
                 key='seq1'
             )
             
             seq2_id = st.selectbox(
                 "Select Second Sequence",
-                [obj.sequence_id for obj in st.session_state.sequence_objects],
+                st.session_state.sequence_objects.sequence_ids,
                 key='seq2'
             )
             
             alignment_method = st.radio(
                 "Alignment Method",
-                ['global', 'local']
+                ['global', 'local', 'seeded'],
+                help="'seeded' anchors exact k-mer matches and only aligns between them, for long similar genomes"
             )
+            
+            with st.expander("Scoring parameters"):
+                match_score = st.number_input("Match score", value=2.0, step=0.5)
+                mismatch_score = st.number_input("Mismatch score", value=-1.0, step=0.5)
+                open_gap_score = st.number_input("Gap open score", value=-0.5, step=0.1)
+                extend_gap_score = st.number_input("Gap extend score", value=-0.1, step=0.1)
+            
+            sequence_types = st.session_state.sequence_objects.sequence_types
+            if sequence_types[seq1_id] == "DNA" and (sequence_types == "DNA").sum() > 2:
+                show_similar_sequences(seq1_id)
         
         if seq1_id != seq2_id:
-            seq1 = next(obj for obj in st.session_state.sequence_objects if obj.sequence_id == seq1_id)
-            seq2 = next(obj for obj in st.session_state.sequence_objects if obj.sequence_id == seq2_id)
+            seq1 = st.session_state.sequence_objects[seq1_id]
+            seq2 = st.session_state.sequence_objects[seq2_id]
             
-            aligner = BioPythonAligner()
+            aligner = BioPythonAligner(match_score, mismatch_score, open_gap_score, extend_gap_score)
             
             try:
-                alignment_result = aligner.align_sequences(
-                    seq1.sequence,
-                    seq2.sequence,
-                    method=alignment_method
-                )
+                # unpacked once, every access to .sequence of a DNA record unpacks it again
+                sequence1, sequence2 = seq1.sequence, seq2.sequence
+                # repeated comparisons come back from memory or the on-disk cache
+                alignment_cache = get_alignment_cache()
+                key = alignment_key(sequence1, sequence2, alignment_method, aligner.scoring())
+                alignment_result = alignment_cache.get(key)
+                if alignment_result is None:
+                    cells = len(sequence1) * len(sequence2)
+                    if (alignment_method == 'seeded' and cells > INLINE_ALIGNMENT_CELLS
+                            and len(sequence1) + len(sequence2) <= INLINE_SEEDED_BASES):
+                        # seeded DP only fills the gaps between anchors, pairs sharing none still cost the full product
+                        cells = aligner.seeded_cells(sequence1, sequence2)
+                    if cells <= INLINE_ALIGNMENT_CELLS:
+                        alignment_result = aligner.align_sequences(sequence1, sequence2, alignment_method)
+                        alignment_cache.put(key, alignment_result)
+                    else:
+                        with col2:
+                            alignment_result = background_result(
+                                key,
+                                f"{alignment_method} alignment of {seq1_id} and {seq2_id}",
+                                align_task,
+                                aligner.scoring(),
+                                sequence1,
+                                sequence2,
+                                alignment_method,
+                                on_done=lambda result: alignment_cache.put(key, result)
+                            )
+                        if alignment_result is None:
+                            return
                 
                 with col2:
                     st.subheader("Alignment Results")
@@ -307,53 +731,23 @@ def show_sequence_alignment():
                     st.metric("Percent Identity", f"{alignment_result['percent_identity']:.2f}%")
                     st.metric("Number of Gaps", alignment_result['gaps'])
                     
-                    blocks = aligner.format_alignment(alignment_result)
                     st.subheader("Alignment Visualization")
                     
-                    st.markdown("""
-                        <style>
-                        .alignment-block {
-                            font-family: monospace;
-                            white-space: pre;
-                            padding: 10px;
-                            margin: 10px 0;
-                            background-color: #f5f5f5;
-                            border-radius: 5px;
-                        }
-                        .position-header {
-                            color: #666;
-                            font-size: 0.9em;
-                            margin-bottom: 5px;
-                        }
-                        .sequence {
-                            color: #1a1a1a;
-                        }
-                        .match-line {
-                            color: #0066cc;
-                        }
-                        </style>
-                    """, unsafe_allow_html=True)
-
-                    window_size = st.slider("Alignment window size", 60, 200, 60)
-                    start_position = st.slider("Start position", 0, len(blocks) * 60 - window_size, 0)
-                    
-                    start_block = start_position // 60
-                    end_block = (start_position + window_size) // 60 + 1
-                    blocks_to_show = blocks[start_block:end_block]
-
-                    for block in blocks_to_show:
-                        html = f"""
-                        <div class="alignment-block">
-                            <div class="position-header">Position {block['position']}</div>
-                            <div class="sequence">{block['seq1']}</div>
-                            <div class="match-line">{block['match']}</div>
-                            <div class="sequence">{block['seq2']}</div>
-                        </div>
-                        """
-                        st.markdown(html, unsafe_allow_html=True)
+                    alignment_length = len(alignment_result['aligned_seq1'])
+                    window_size = st.slider("Alignment window size", 60, 1200, 300, step=60)
+                    # any column can start the window, the blocks are cut from there
+                    start_position = 0
+                    if alignment_length > window_size:
+                        start_position = st.slider("Start position", 0, alignment_length - window_size, 0)
                     
-                    if len(blocks) > 5:
-                        st.info("Showing first 5 alignment blocks. Scroll to see more.")
+                    blocks = aligner.format_alignment(
+                        alignment_result,
+                        ALIGNMENT_LINE_WIDTH,
+                        start=start_position,
+                        end=start_position + window_size
+                    )
+                    st.markdown(render_alignment_blocks(blocks), unsafe_allow_html=True)
+                    st.caption(f"Columns {start_position:,}-{min(start_position + window_size, alignment_length):,} of {alignment_length:,}")
                         
             except Exception as e:
                 st.error(f"Error performing alignment: {str(e)}")
@@ -0,0 +1 @@
+"""Performance benchmarks on synthetic FASTA datasets, run with python -m benchmarks"""
@@ -0,0 +1,52 @@
+import argparse
+import os
+import sys
+from benchmarks.synthetic import SCALES
+from benchmarks.suite import BENCHMARKS, compare, load_results, run_suite, save_results
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Time and memory benchmarks on synthetic FASTA data")
+    parser.add_argument('--scale', nargs='+', choices=list(SCALES), default=['small', 'medium'])
+    parser.add_argument('--benchmark', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help="where the generated datasets are kept between runs")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the new baseline instead of comparing")
+    parser.add_argument('--output', help="also write the results of this run to a JSON file")
+    parser.add_argument('--time-threshold', type=float, default=0.2, help="allowed slowdown as a fraction of the baseline")
+    parser.add_argument('--memory-threshold', type=float, default=0.2, help="allowed peak memory growth as a fraction of the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.scale, args.benchmark, args.data_dir, args.repeat,
+                        progress=lambda name: print(f"running {name}", file=sys.stderr))
+
+    print(f"{'benchmark':<24}{'best s':>12}{'mean s':>12}{'peak MiB':>12}")
+    for key, result in results['results'].items():
+        print(f"{key:<24}{result['seconds']:>12.4f}{result['mean_seconds']:>12.4f}{result['peak_bytes'] / 2 ** 20:>12.2f}")
+
+    if args.output:
+        save_results(results, args.output)
+
+    if args.save_baseline:
+        save_results(results, args.baseline)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --save-baseline first")
+        return 0
+
+    regressions = compare(results, load_results(args.baseline), args.time_threshold, args.memory_threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression['benchmark']} {regression['metric']}: "
+              f"{regression['baseline']:.4g} -> {regression['current']:.4g} ({regression['ratio']:.2f}x)")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
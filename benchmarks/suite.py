@@ -0,0 +1,140 @@
+import gc
+import json
+import platform
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, Iterable, List, Optional
+from fasta_parser import FastaParser
+from composition import composition_table
+from gene_classes import BioPythonAligner
+from benchmarks.synthetic import SCALES, DatasetSpec, dataset_path
+
+
+#motif searched in every record, by alphabet
+MOTIFS = {'DNA': 'GATTACA', 'RNA': 'GAUUACA', 'protein': 'MKV'}
+
+#motif found every few symbols, the search cost grows with the hits as well as with the length
+DENSE_MOTIFS = {'DNA': 'AC', 'RNA': 'AC', 'protein': 'A'}
+
+#length of the two sequences handed to the aligner, alignment is quadratic so it is capped
+ALIGNMENT_LENGTH = 1_000
+
+
+class Benchmark:
+    """setup(path, spec) prepares the inputs outside the measurement, run(state) is what gets measured"""
+
+    def __init__(self, name: str, run: Callable, setup: Optional[Callable] = None):
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda path, spec: path)
+
+
+def _parsed(path, spec):
+    return FastaParser.parse_file(path)
+
+
+def _objects(path, spec):
+    return FastaParser.create_sequence_objects(FastaParser.parse_file(path)), MOTIFS[spec.alphabet]
+
+
+def _dense_objects(path, spec):
+    return FastaParser.create_sequence_objects(FastaParser.parse_file(path)), DENSE_MOTIFS[spec.alphabet]
+
+
+def _find_motif(state):
+    objects, motif = state
+    return sum(len(obj.find_motif(motif)) for obj in objects)
+
+
+def _alignment_inputs(path, spec):
+    sequences = FastaParser.parse_file(path)['sequence']
+    return BioPythonAligner(), sequences.iloc[0][:ALIGNMENT_LENGTH], sequences.iloc[-1][:ALIGNMENT_LENGTH]
+
+
+BENCHMARKS = {
+    benchmark.name: benchmark for benchmark in (
+        Benchmark('parse', FastaParser.parse_file),
+        Benchmark('objects', FastaParser.create_sequence_objects, _parsed),
+        Benchmark('composition', composition_table, _parsed),
+        Benchmark('find_motif', _find_motif, _objects),
+        Benchmark('find_motif_dense', _find_motif, _dense_objects),
+        Benchmark('align', lambda state: state[0].align_sequences(state[1], state[2]), _alignment_inputs)
+    )
+}
+
+
+def measure(benchmark: Benchmark, path, spec: DatasetSpec, repeat: int = 3) -> Dict:
+    """Best wall time over repeat runs, then the peak of memory traced during one more run"""
+    state = benchmark.setup(path, spec)
+
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        benchmark.run(state)
+        times.append(time.perf_counter() - start)
+
+    # tracemalloc slows allocation down, so it gets a run of its own and never skews the timings
+    gc.collect()
+    tracemalloc.start()
+    try:
+        benchmark.run(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': min(times), 'mean_seconds': float(np.mean(times)), 'peak_bytes': peak, 'dataset': spec.to_dict()}
+
+
+def run_suite(scales: Iterable[str], benchmarks: Iterable[str], data_dir, repeat: int = 3,
+              progress: Callable[[str], None] = lambda message: None) -> Dict:
+    """Run every benchmark at every scale, results are keyed 'benchmark/scale'"""
+    results = {}
+    for scale in scales:
+        spec = SCALES[scale]
+        path = dataset_path(spec, data_dir)
+        for name in benchmarks:
+            progress(f"{name}/{scale}")
+            results[f"{name}/{scale}"] = measure(BENCHMARKS[name], path, spec, repeat)
+    return {'environment': environment(), 'results': results}
+
+
+def environment() -> Dict:
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__
+    }
+
+
+def compare(results: Dict, baseline: Dict, time_threshold: float = 0.2, memory_threshold: float = 0.2) -> List[Dict]:
+    """Every result slower or hungrier than its baseline by more than the threshold (a fraction, 0.2 = 20%)"""
+    regressions = []
+    for key, result in results['results'].items():
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+        for metric, threshold in (('seconds', time_threshold), ('peak_bytes', memory_threshold)):
+            if reference[metric] > 0 and result[metric] > reference[metric] * (1 + threshold):
+                regressions.append({
+                    'benchmark': key,
+                    'metric': metric,
+                    'baseline': reference[metric],
+                    'current': result[metric],
+                    'ratio': result[metric] / reference[metric]
+                })
+    return regressions
+
+
+def load_results(path) -> Dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_results(results: Dict, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
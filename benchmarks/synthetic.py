@@ -0,0 +1,64 @@
+import os
+import numpy as np
+from dataclasses import dataclass, asdict
+from typing import Dict
+
+
+ALPHABETS = {
+    'DNA': 'ACGT',
+    'RNA': 'ACGU',
+    'protein': 'ACDEFGHIKLMNPQRSTVWY'
+}
+
+
+@dataclass(frozen=True)
+class DatasetSpec:
+    """Shape of a synthetic FASTA file"""
+    records: int
+    length: int
+    alphabet: str = 'DNA'
+    line_width: int = 60
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.alphabet}-{self.records}x{self.length}-w{self.line_width}"
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+
+# the scales every benchmark runs at, small enough for a laptop and large enough to show trends
+SCALES = {
+    'small': DatasetSpec(records=100, length=1_000),
+    'medium': DatasetSpec(records=1_000, length=10_000),
+    'large': DatasetSpec(records=200, length=500_000),
+    'protein': DatasetSpec(records=2_000, length=400, alphabet='protein')
+}
+
+
+def generate_fasta(spec: DatasetSpec, path) -> str:
+    """Write a reproducible random FASTA file for spec, records are written one at a time"""
+    rng = np.random.default_rng(spec.seed)
+    symbols = np.frombuffer(ALPHABETS[spec.alphabet].encode(), dtype=np.uint8)
+
+    with open(path, 'wb') as file:
+        for i in range(spec.records):
+            sequence = symbols[rng.integers(0, len(symbols), spec.length)]
+            # a newline after every line_width symbols, the last line may be shorter
+            lines = [sequence[j:j + spec.line_width].tobytes() for j in range(0, spec.length, spec.line_width)]
+            file.write(f">seq{i:07d} synthetic {spec.alphabet} record {i}\n".encode())
+            file.write(b'\n'.join(lines))
+            file.write(b'\n')
+    return path
+
+
+def dataset_path(spec: DatasetSpec, directory) -> str:
+    """Path of the file for spec in directory, generated on first use and reused afterwards"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{spec.name}-s{spec.seed}.fasta")
+    if not os.path.exists(path):
+        # written under a temporary name so an interrupted run never leaves a truncated dataset
+        generate_fasta(spec, path + '.part')
+        os.replace(path + '.part', path)
+    return path
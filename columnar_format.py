@@ -0,0 +1,143 @@
+"""Binary columnar storage for parsed FASTA datasets
+
+Layout of a file, all integers little-endian and every section 8-byte aligned:
+
+    b'FASTACOL'                    magic
+    sequence_data                  every sequence concatenated, ASCII bytes
+    sequence_offsets  int64[n+1]   sequence i is sequence_data[offsets[i]:offsets[i+1]]
+    id_data, id_offsets            the same for sequence ids (UTF-8)
+    description_data, ...offsets   the same for descriptions (UTF-8)
+    footer                         JSON: {"version", "n_records", "sections": {name: [offset, dtype, count]}}
+    footer length  uint64
+    b'FASTACOL'                    magic
+
+The footer sits at the end so a dataset can be written while its records are streamed.
+Loading memory-maps the file and every column is a view into the map, nothing is copied.
+"""
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Union
+from gene_classes import classify_sequence
+
+
+MAGIC = b'FASTACOL'
+VERSION = 1
+
+
+def _pad(file):
+    file.write(b'\0' * (-file.tell() % 8))
+
+
+def write_columnar(records: Union[pd.DataFrame, Iterable[Dict]], path) -> int:
+    """Write a DataFrame from FastaParser.parse_file, or a stream of record dicts, returns the record count"""
+    if isinstance(records, pd.DataFrame):
+        records = (
+            {'sequence_id': sequence_id, 'sequence_description': description, 'sequence': sequence}
+            for sequence_id, description, sequence in zip(records.index, records['sequence_description'], records['sequence'])
+        )
+
+    sections = {}
+    sequence_offsets = [0]
+    ids, descriptions = [], []
+
+    with open(path, 'wb') as file:
+        file.write(MAGIC)
+        data_start = file.tell()
+
+        # sequences go straight to disk, only the offsets and the short text columns stay in memory
+        for record in records:
+            sequence = record['sequence'].encode('ascii')
+            file.write(sequence)
+            sequence_offsets.append(sequence_offsets[-1] + len(sequence))
+            ids.append(record['sequence_id'].encode())
+            descriptions.append(record['sequence_description'].encode())
+        sections['sequence_data'] = [data_start, 'u1', sequence_offsets[-1]]
+
+        def write_array(name, array):
+            _pad(file)
+            sections[name] = [file.tell(), array.dtype.str, len(array)]
+            file.write(array.tobytes())
+
+        write_array('sequence_offsets', np.array(sequence_offsets, dtype='<i8'))
+        for name, values in (('id', ids), ('description', descriptions)):
+            write_array(f'{name}_offsets', np.concatenate([[0], np.cumsum([len(v) for v in values])]).astype('<i8'))
+            write_array(f'{name}_data', np.frombuffer(b''.join(values), dtype='u1'))
+
+        footer = json.dumps({'version': VERSION, 'n_records': len(ids), 'sections': sections}).encode()
+        file.write(footer)
+        file.write(np.array([len(footer)], dtype='<u8').tobytes())
+        file.write(MAGIC)
+
+    return len(ids)
+
+
+class ColumnarDataset:
+    """Memory-mapped view of a file written by write_columnar"""
+
+    def __init__(self, path):
+        self.path = path
+        self._map = np.memmap(path, dtype='u1', mode='r')
+
+        if bytes(self._map[:8]) != MAGIC or bytes(self._map[-8:]) != MAGIC:
+            raise ValueError(f"{path} is not a columnar FASTA dataset")
+        footer_length = int(self._map[-16:-8].view('<u8')[0])
+        footer = json.loads(bytes(self._map[-16 - footer_length:-16]))
+        if footer['version'] != VERSION:
+            raise ValueError(f"Unsupported columnar dataset version {footer['version']}")
+
+        self._columns = {
+            name: self._map[offset:offset + count * np.dtype(dtype).itemsize].view(dtype)
+            for name, (offset, dtype, count) in footer['sections'].items()
+        }
+        self._sequence_ids = None
+
+    def __len__(self):
+        return len(self._columns['sequence_offsets']) - 1
+
+    def _text(self, name: str, i: int, encoding: str) -> str:
+        offsets = self._columns[f'{name}_offsets']
+        return self._columns[f'{name}_data'][offsets[i]:offsets[i + 1]].tobytes().decode(encoding)
+
+    @property
+    def sequence_ids(self) -> List[str]:
+        if self._sequence_ids is None:
+            self._sequence_ids = [self._text('id', i, 'utf-8') for i in range(len(self))]
+        return self._sequence_ids
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self._columns['sequence_offsets'])
+
+    @property
+    def sequence_data(self) -> np.ndarray:
+        """Every sequence concatenated, as a read-only uint8 view of the file"""
+        return self._columns['sequence_data']
+
+    @property
+    def sequence_offsets(self) -> np.ndarray:
+        return self._columns['sequence_offsets']
+
+    def description(self, i: int) -> str:
+        return self._text('description', i, 'utf-8')
+
+    def sequence_bytes(self, i: int) -> np.ndarray:
+        """Sequence i as a uint8 view of the file, without copying"""
+        offsets = self._columns['sequence_offsets']
+        return self._columns['sequence_data'][offsets[i]:offsets[i + 1]]
+
+    def sequence(self, i: int) -> str:
+        return self._text('sequence', i, 'ascii')
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Materialize the usual FastaParser.parse_file DataFrame"""
+        classes = [classify_sequence(self.sequence_bytes(i)) for i in range(len(self))]
+        df = pd.DataFrame({
+            'sequence_id': self.sequence_ids,
+            'sequence_description': [self.description(i) for i in range(len(self))],
+            'sequence': [self.sequence(i) for i in range(len(self))],
+            'sequence_type': [sequence_type for sequence_type, _ in classes],
+            'invalid_symbols': [invalid_symbols for _, invalid_symbols in classes]
+        })
+        df.set_index('sequence_id', inplace=True)
+        return df
@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+from typing import Optional
+from fasta_parser import detect_sequence_type
+from instrumentation import instrumented
+
+
+DNA_ALPHABET = 'ACGT'
+RNA_ALPHABET = 'ACGU'
+PROTEIN_ALPHABET = 'GAVLIDENQPFWKCMYRHST'
+
+# number of bases counted in one bincount, bounds the temporary arrays
+BATCH_BASES = 1 << 24
+
+
+def _symbol_codes(alphabet: str) -> np.ndarray:
+    #byte -> column in the counts matrix, lower case included, everything outside the alphabet goes to the last one
+    codes = np.full(256, len(alphabet), dtype=np.int32)
+    codes[np.frombuffer(alphabet.encode(), dtype=np.uint8)] = np.arange(len(alphabet), dtype=np.int32)
+    codes[np.frombuffer(alphabet.lower().encode(), dtype=np.uint8)] = np.arange(len(alphabet), dtype=np.int32)
+    return codes
+
+
+@instrumented
+def composition_table(df: pd.DataFrame, sequence_type: Optional[str] = None) -> pd.DataFrame:
+    """Absolute and relative composition of every sequence in df, computed with one bincount per batch
+
+    Without a sequence_type, records are grouped by their sequence_type column and each group is counted
+    against its own alphabet, so a mixed file gets zero counts for the symbols outside a record's alphabet
+    and NaN GC content for its proteins.
+    """
+    if sequence_type is not None or 'sequence_type' not in df or df['sequence_type'].nunique() <= 1:
+        return _composition(df, sequence_type or detect_sequence_type(df))
+
+    groups = df.groupby('sequence_type', sort=False)
+    tables = [_composition(df.iloc[rows], group_type) for group_type, rows in groups.indices.items()]
+    order = np.argsort(np.concatenate(list(groups.indices.values())), kind='stable')
+    table = pd.concat(tables).iloc[order]
+
+    symbols = list(dict.fromkeys(column for t in tables for column in t.columns[:t.columns.get_loc('ambiguous')]))
+    columns = symbols + ['ambiguous', 'length'] + [f'{symbol}_percentage' for symbol in symbols + ['ambiguous']]
+    table[columns] = table.reindex(columns=columns).fillna(0)
+    table[symbols] = table[symbols].astype(np.int64)
+    return table[columns + [column for column in table.columns if column not in columns]]
+
+
+def _composition(df: pd.DataFrame, sequence_type: str) -> pd.DataFrame:
+    alphabet = {"DNA": DNA_ALPHABET, "RNA": RNA_ALPHABET}.get(sequence_type, PROTEIN_ALPHABET)
+    codes = _symbol_codes(alphabet)
+    n_columns = len(alphabet) + 1
+
+    sequences = df['sequence'].tolist()
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    counts = np.zeros((len(sequences), n_columns), dtype=np.int64)
+    cumulative = np.concatenate([[0], np.cumsum(lengths)])
+
+    start = 0
+    while start < len(sequences):
+        # take records until the batch is full, always at least one
+        end = int(np.searchsorted(cumulative, cumulative[start] + BATCH_BASES, side='right')) - 1
+        end = min(max(end, start + 1), len(sequences))
+
+        raw = np.frombuffer(''.join(sequences[start:end]).encode('ascii'), dtype=np.uint8)
+        record = np.repeat(np.arange(end - start, dtype=np.int32), lengths[start:end])
+        cells = record * n_columns + codes[raw]
+        counts[start:end] = np.bincount(cells, minlength=(end - start) * n_columns).reshape(-1, n_columns)
+
+        start = end
+
+    table = pd.DataFrame(counts, index=df.index, columns=list(alphabet) + ['ambiguous'])
+    table['length'] = lengths
+
+    # empty sequences get NaN percentages instead of a division error
+    safe_lengths = np.where(lengths > 0, lengths, np.nan)
+    for symbol in alphabet:
+        table[f'{symbol}_percentage'] = table[symbol] / safe_lengths * 100
+    table['ambiguous_percentage'] = table['ambiguous'] / safe_lengths * 100
+    if sequence_type in ("DNA", "RNA"):
+        table['GC_content_percentage'] = (table['G'] + table['C']) / safe_lengths * 100
+
+    return table
+
+
+PROFILE_COLUMNS = ['sequence_id', 'start', 'end', 'GC_percentage', 'GC_skew', 'AT_skew']
+
+#byte -> 0 A, 1 C, 2 G, 3 T/U, 4 anything else, lower case included
+_PROFILE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _symbols in enumerate(('Aa', 'Cc', 'Gg', 'TtUu')):
+    _PROFILE_CODES[np.frombuffer(_symbols.encode(), dtype=np.uint8)] = _code
+
+
+def _window_starts(length: int, window: int, step: int) -> np.ndarray:
+    # a sequence shorter than the window gets a single window over all of it
+    if length <= window:
+        return np.zeros(1, dtype=np.int64)
+    return np.arange(0, length - window + 1, step, dtype=np.int64)
+
+
+def _skew(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    total = a + b
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, (a - b) / total, np.nan)
+
+
+@instrumented
+def gc_profiles(data, window: int = 1000, step: Optional[int] = None) -> pd.DataFrame:
+    """Sliding-window GC%, GC skew (G-C)/(G+C) and AT skew (A-T)/(A+T) of every sequence
+
+    data is a DataFrame from FastaParser.parse_file, a Series of sequences or a single sequence string. Every
+    window is the difference of two prefix sums, so a batch costs O(total length) whatever window and step are.
+    """
+    if window < 1:
+        raise ValueError("window must be at least 1")
+    step = step or max(1, window // 2)
+    if step < 1:
+        raise ValueError("step must be at least 1")
+
+    if isinstance(data, str):
+        sequences = pd.Series([data], index=[None])
+    elif isinstance(data, pd.DataFrame):
+        sequences = data['sequence']
+    else:
+        sequences = pd.Series(data)
+
+    ids = sequences.index.tolist()
+    sequences = sequences.tolist()
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    cumulative = np.concatenate([[0], np.cumsum(lengths)])
+    frames = []
+
+    start = 0
+    while start < len(sequences):
+        # same batching as composition_table, the prefix sums never grow past BATCH_BASES per symbol
+        end = int(np.searchsorted(cumulative, cumulative[start] + BATCH_BASES, side='right')) - 1
+        end = min(max(end, start + 1), len(sequences))
+
+        codes = _PROFILE_CODES[np.frombuffer(''.join(sequences[start:end]).encode('ascii'), dtype=np.uint8)]
+
+        offsets = cumulative[start:end] - cumulative[start]
+        starts = [_window_starts(int(length), window, step) for length in lengths[start:end]]
+        counts_per_record = np.fromiter(map(len, starts), dtype=np.int64, count=end - start)
+        local_starts = np.concatenate(starts)
+        local_ends = np.minimum(local_starts + window, np.repeat(lengths[start:end], counts_per_record))
+        first = local_starts + np.repeat(offsets, counts_per_record)
+        last = local_ends + np.repeat(offsets, counts_per_record)
+
+        # one int32 prefix sum at a time, prefix[i] is the count of symbol k in the first i bases of the batch
+        prefix = np.zeros(len(codes) + 1, dtype=np.int32)
+        window_counts = []
+        for k in range(4):
+            np.cumsum(codes == k, out=prefix[1:])
+            window_counts.append(prefix[last] - prefix[first])
+        a, c, g, t = window_counts
+        spans = (local_ends - local_starts).astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gc_percentage = np.where(spans > 0, (g + c) / spans * 100, np.nan)
+
+        frames.append(pd.DataFrame({
+            'sequence_id': np.repeat(np.array(ids[start:end], dtype=object), counts_per_record),
+            'start': local_starts,
+            'end': local_ends,
+            'GC_percentage': gc_percentage,
+            'GC_skew': _skew(g, c),
+            'AT_skew': _skew(a, t)
+        }))
+        start = end
+
+    if not frames:
+        return pd.DataFrame(columns=PROFILE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def gc_profile(sequence: str, window: int = 1000, step: Optional[int] = None) -> pd.DataFrame:
+    """gc_profiles of one sequence, without the sequence_id column"""
+    return gc_profiles(sequence, window, step).drop(columns='sequence_id')
+
+
+def downsample_profile(profile: pd.DataFrame, max_points: int = 2000) -> pd.DataFrame:
+    """At most max_points rows for plotting, each bucket of windows keeps its mean, min and max
+
+    The min and max columns (e.g. GC_percentage_min) keep narrow peaks visible that a plain mean would flatten.
+    """
+    if len(profile) <= max_points:
+        return profile
+    bucket = np.arange(len(profile)) * max_points // len(profile)
+    metrics = [column for column in ('GC_percentage', 'GC_skew', 'AT_skew') if column in profile]
+    grouped = profile.groupby(bucket)
+    reduced = grouped[metrics].mean()
+    reduced.insert(0, 'start', grouped['start'].first())
+    reduced.insert(1, 'end', grouped['end'].last())
+    for column in metrics:
+        reduced[f'{column}_min'] = grouped[column].min()
+        reduced[f'{column}_max'] = grouped[column].max()
+    return reduced.reset_index(drop=True)
@@ -0,0 +1,100 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+
+def content_hash(data) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class DatasetCache:
+    """LRU cache of parsed datasets keyed by content hash, bounded by entry count and total size
+
+    One instance is shared by every session of the app, so it is guarded by a lock.
+    """
+
+    def __init__(self, max_entries: int = 8, max_bytes: int = 2 * 1024 ** 3):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+        # one lock per derived object being built, see attach
+        self._building = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: Dict, size: int):
+        with self._lock:
+            self._entries[key] = entry
+            self._sizes[key] = size
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def get_or_build(self, key: str, build: Callable[[], tuple]) -> Dict:
+        """Return the cached entry, or build it with build() -> (entry, size) and store it"""
+        entry = self.get(key)
+        if entry is None:
+            # built outside the lock so other sessions are not blocked by a long parse
+            entry, size = build()
+            self.put(key, entry, size)
+        return entry
+
+    def attach(self, key: str, entry: Dict, name: str, build: Callable[[], tuple]):
+        """entry[name], built on first use with build() -> (value, size) and added to the size of the entry
+
+        For objects derived from a cached dataset after it was stored, e.g. an index. Sessions asking for the
+        same object at once wait for the one building it instead of building their own.
+        """
+        with self._lock:
+            value = entry.get(name)
+            if value is not None:
+                return value
+            building = self._building.setdefault((key, name), threading.Lock())
+
+        with building:
+            value = entry.get(name)
+            if value is not None:
+                return value
+            # built outside the cache lock, only the sessions waiting for this object are blocked
+            value, size = build()
+            with self._lock:
+                entry[name] = value
+                self._building.pop((key, name), None)
+                # an entry evicted in the meantime only lives on in the sessions holding it
+                if self._entries.get(key) is entry:
+                    self._sizes[key] += size
+                    self._evict()
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+
+    def _evict(self):
+        # least recently used first, the newest entry always stays
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            key, _ = self._entries.popitem(last=False)
+            del self._sizes[key]
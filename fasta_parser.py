@@ -1,90 +1,438 @@
+import gzip
+import io
+import os
+import numpy as np
 import pandas as pd
-from typing import List, Iterator
+from Bio import bgzf
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Iterator, Optional
 from pathlib import Path
 from gene_classes import *
+from instrumentation import instrumented
+from columnar_format import ColumnarDataset, write_columnar
+from sequence_collection import SequenceCollection
 
 
+FAI_COLUMNS = ['sequence_id', 'length', 'offset', 'line_bases', 'line_width']
+
+# loaded indexes, keyed by FASTA path and invalidated when the file changes
+_index_cache: Dict[str, tuple] = {}
+_gzi_cache: Dict[str, tuple] = {}
+
+
+# dropped from sequence lines, wherever they appear
+_WHITESPACE = b' \t\r\n\v\f'
+
+RECORD_COLUMNS = ['sequence_id', 'sequence_description', 'sequence', 'sequence_type', 'invalid_symbols']
+
+
+def _record(sequence_id: str, description: str, sequence: bytes) -> Dict:
+    # the alphabet is classified while the record is assembled, not in a second pass
+    sequence_type, invalid_symbols = classify_sequence(sequence)
+    return {
+        'sequence_id': sequence_id,
+        'sequence_description': description,
+        'sequence': sequence.decode(),
+        'sequence_type': sequence_type,
+        'invalid_symbols': invalid_symbols
+    }
+
 def detect_sequence_type(df:pd.DataFrame):
+    if 'sequence_type' in df:
+        return df['sequence_type'].iat[0]
     test_sequence=df.iloc[0].sequence
-    unique_chars = set(test_sequence.upper())
-    if unique_chars.issubset(set("ATCGU")):
-        return "DNA"
-    else:
-        return "protein"
+    return classify_sequence(test_sequence)[0]
 
 class FastaParser:
     
-    def parse_file(file_path):
-        records = []
+    def iter_records(file_path) -> Iterator[Dict]:
+        """Yield one record dict at a time, keeping only the current sequence in memory"""
+        with _open_fasta(file_path, binary=True) as file:
+            yield from FastaParser.iter_stream_records(file)
+    
+    def iter_stream_records(stream) -> Iterator[Dict]:
+        """Yield records from a binary file-like object, gzip streams are decompressed on the fly"""
+        stream = _decompressed_stream(stream)
+        current_id = None
+        current_desc = None
+        current_seq = []
         
-        with open(file_path) as file:
-            current_id = None
-            current_desc = None
-            current_seq = []
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
             
-            for line in file:
-                line = line.strip()
-                if not line:
-                    continue
+            #identifying the header sequence
+            if line.startswith(b'>'):
+                #yielding the old data if we had it stored    
+                if current_id:
+                    yield _record(current_id, current_desc, b''.join(current_seq).translate(None, _WHITESPACE))
                 
-                #identifying the header sequence
-                if line.startswith('>'):
-                    #saving the old data if we had it stored    
-                    if current_id:
-                        records.append({
-                            'sequence_id': current_id,
-                            'sequence_description': current_desc,
-                            'sequence': ''.join(current_seq)
-                        })
-                    
-                    # Start new sequence
-                    # Remove '>' and split into id and description (maximum of 1 split)
-                    parts = line[1:].split(maxsplit=1)
-                    current_id = parts[0]
-                    current_desc = parts[1] if len(parts) > 1 else ''
-                    current_seq = []
-                else:
-                    current_seq.append(line)
-            
-            if current_id:
-                records.append({
-                    'sequence_id': current_id,
-                    'sequence_description': current_desc, 
-                    'sequence': ''.join(current_seq)
-                })
+                # Start new sequence
+                # Remove '>' and split into id and description (maximum of 1 split)
+                parts = line[1:].decode().split(maxsplit=1)
+                current_id = parts[0] if parts else None
+                current_desc = parts[1] if len(parts) > 1 else ''
+                current_seq = []
+            else:
+                current_seq.append(line)
+        
+        if current_id:
+            yield _record(current_id, current_desc, b''.join(current_seq).translate(None, _WHITESPACE))
+    
+    @instrumented
+    def parse_bytes(data) -> pd.DataFrame:
+        """Parse FASTA held in memory (bytes, bytearray, memoryview or a NumPy buffer) without copying it"""
+        if bytes(memoryview(data)[:2]) == b'\x1f\x8b':
+            data = gzip.decompress(data)
+        return _columns_to_dataframe(_parse_buffer(data))
+    
+    @instrumented
+    def parse_stream(stream) -> pd.DataFrame:
+        """Parse a binary file-like object, plain or gzip, reading it line by line"""
+        return _records_to_dataframe(list(FastaParser.iter_stream_records(stream)))
+    
+    def iter_dataframes(file_path, batch_size: int = 1000) -> Iterator[pd.DataFrame]:
+        """Yield DataFrames of at most batch_size records, indexed by sequence_id"""
+        if batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
+        
+        batch = []
+        for record in FastaParser.iter_records(file_path):
+            batch.append(record)
+            if len(batch) == batch_size:
+                yield _records_to_dataframe(batch)
+                batch = []
+        
+        if batch:
+            yield _records_to_dataframe(batch)
+    
+    @instrumented
+    def parse_file(file_path, workers: Optional[int] = 1):
+        # workers=None uses every core, anything other than 1 goes through the sharded parser
+        if workers != 1:
+            return FastaParser.parse_file_parallel(file_path, workers)
+        return _records_to_dataframe(list(FastaParser.iter_records(file_path)))
+    
+    @instrumented
+    def parse_file_parallel(file_path, workers: Optional[int] = None, shard_size: int = 16 * 1024 * 1024) -> pd.DataFrame:
+        """Parse byte ranges of the file in a process pool, each range snapped to the next header"""
+        # compressed input has no byte offsets to split on, it is streamed instead
+        if _is_gzip(file_path):
+            return _records_to_dataframe(list(FastaParser.iter_records(file_path)))
+        
+        workers = workers or os.cpu_count() or 1
+        file_size = os.path.getsize(file_path)
+        n_shards = max(1, min(workers * 4, file_size // shard_size))
+        
+        with open(file_path, 'rb') as file:
+            starts = sorted({_next_header(file, file_size * i // n_shards) for i in range(n_shards)})
+        shards = [(file_path, start, end) for start, end in zip(starts, starts[1:] + [file_size]) if start < end]
+        
+        if len(shards) <= 1 or workers == 1:
+            parsed = [_parse_shard(*shard) for shard in shards]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parsed = list(pool.map(_parse_shard, *zip(*shards)))
         
-        df = pd.DataFrame(records)
-        df.set_index('sequence_id', inplace=True)
-        return df
+        # shards come back in file order, so concatenating keeps the record order
+        columns = tuple([] for _ in RECORD_COLUMNS)
+        for shard_columns in parsed:
+            for values, shard_values in zip(columns, shard_columns):
+                values.extend(shard_values)
+        return _columns_to_dataframe(columns)
+    
+    @instrumented
+    def save_dataset(source, path) -> int:
+        """Save a parsed DataFrame, or stream a FASTA file, into the binary columnar format"""
+        records = source if isinstance(source, pd.DataFrame) else FastaParser.iter_records(source)
+        return write_columnar(records, path)
+    
+    @instrumented
+    def load_dataset(path) -> ColumnarDataset:
+        """Memory-map a dataset written by save_dataset, the columns are views of the file"""
+        return ColumnarDataset(path)
     
+    def iter_sequence_objects(records: Iterable[Dict]) -> Iterator[Gene]:
+        """Build sequence objects lazily, each with the class of its own detected type"""
+        for record in records:
+            sequence_type = record.get('sequence_type') or classify_sequence(record['sequence'])[0]
+            
+            yield SEQUENCE_CLASSES[sequence_type](
+                sequence_id=record['sequence_id'],
+                sequence_description=record['sequence_description'],
+                sequence=record['sequence']
+            )
+    
+    @instrumented
     def create_sequence_objects(df: pd.DataFrame):
+        
+        # a DataFrame from parse_file or a path to stream the records from
+        if isinstance(df, pd.DataFrame):
+            types = df['sequence_type'] if 'sequence_type' in df else [None] * len(df)
+            records = (
+                {'sequence_id': sequence_id, 'sequence_description': description, 'sequence': sequence, 'sequence_type': sequence_type}
+                for sequence_id, description, sequence, sequence_type in zip(df.index, df['sequence_description'], df['sequence'], types)
+            )
+        else:
+            records = FastaParser.iter_records(df)
+        
+        return list(FastaParser.iter_sequence_objects(records))
 
-        mtdna_list = []
-        if detect_sequence_type(df)=="DNA":
+    
+    @instrumented
+    def create_sequence_collection(data) -> SequenceCollection:
+        """Wrap a parsed DataFrame or a loaded columnar dataset, objects are built on access"""
+        if isinstance(data, pd.DataFrame):
+            sequence_type = detect_sequence_type(data) if len(data) else "DNA"
+        else:
+            sequence_type = classify_sequence(data.sequence_bytes(0))[0] if len(data) else "DNA"
+        return SequenceCollection(data, sequence_type)
+    
+    @instrumented
+    def build_index(file_path) -> pd.DataFrame:
+        """Scan the file once and write a samtools-compatible .fai index next to it
+        
+        Offsets of compressed files are in uncompressed bytes, as with samtools; BGZF files
+        also get their .gzi block index.
+        """
+        entries = []
+        if _is_bgzf(file_path):
+            FastaParser.build_gzi_index(file_path)
+        
+        with _open_fasta(file_path, binary=True) as file:
+            current = None
+            short_line = False
+            position = 0
             
-            for sequence_id, row in df.iterrows():
+            for raw_line in file:
+                line_start = position
+                position += len(raw_line)
+                line = raw_line.rstrip(b'\r\n')
                 
-                mtdna = DNASequence(
-                sequence_id=sequence_id,
-                sequence_description=row['sequence_description'],
-                sequence=row['sequence']
-                )
+                if line.startswith(b'>'):
+                    if current:
+                        entries.append(current)
+                    current = {
+                        'sequence_id': line[1:].split(maxsplit=1)[0].decode(),
+                        'length': 0,
+                        'offset': position,
+                        'line_bases': 0,
+                        'line_width': 0
+                    }
+                    short_line = False
+                    continue
                 
-                mtdna_list.append(mtdna)
+                if current is None:
+                    continue
+                if not line:
+                    short_line = True
+                    continue
                 
-        else:
-            
-            for sequence_id, row in df.iterrows():                
-                mtdna = AmminoacidsSequence(
-                sequence_id=sequence_id,
-                sequence_description=row['sequence_description'],
-                sequence=row['sequence']
-                )
-                    
-                mtdna_list.append(mtdna)
+                # every line but the last of a record must have the same width
+                if short_line:
+                    raise ValueError(f"Inconsistent line length in sequence '{current['sequence_id']}' at byte {line_start}")
+                if current['line_bases'] == 0:
+                    current['line_bases'] = len(line)
+                    current['line_width'] = len(raw_line)
+                elif len(line) > current['line_bases'] or len(raw_line) > current['line_width']:
+                    raise ValueError(f"Inconsistent line length in sequence '{current['sequence_id']}' at byte {line_start}")
+                short_line = len(line) < current['line_bases'] or len(raw_line) < current['line_width']
+                current['length'] += len(line)
             
-                
-        return mtdna_list
+            if current:
+                entries.append(current)
+        
+        index = pd.DataFrame(entries, columns=FAI_COLUMNS)
+        index.to_csv(_index_path(file_path), sep='\t', header=False, index=False)
+        index.set_index('sequence_id', inplace=True)
+        return index
     
+    def load_index(file_path) -> pd.DataFrame:
+        """Return the .fai index of a FASTA file, building it if missing or stale"""
+        key = os.path.abspath(file_path)
+        mtime = os.path.getmtime(file_path)
+        
+        cached = _index_cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        
+        fai_path = _index_path(file_path)
+        if os.path.exists(fai_path) and os.path.getmtime(fai_path) >= mtime:
+            index = pd.read_csv(fai_path, sep='\t', header=None, names=FAI_COLUMNS,
+                                usecols=range(len(FAI_COLUMNS)), dtype={'sequence_id': str})
+            index.set_index('sequence_id', inplace=True)
+        else:
+            index = FastaParser.build_index(file_path)
+        
+        _index_cache[key] = (mtime, index)
+        return index
     
-    
\ No newline at end of file
+    @instrumented
+    def fetch(file_path, sequence_id: str, start: Optional[int] = None, end: Optional[int] = None) -> str:
+        """Read sequence[start:end] of one record straight from disk using the .fai index"""
+        index = FastaParser.load_index(file_path)
+        if sequence_id not in index.index:
+            raise KeyError(f"Sequence '{sequence_id}' not found in {file_path}")
+        
+        length, offset, line_bases, line_width = (int(v) for v in index.loc[sequence_id, FAI_COLUMNS[1:]])
+        start, end, _ = slice(start, end).indices(length)
+        if start >= end:
+            return ''
+        
+        # byte position of a base, skipping the line terminators before it
+        first_byte = offset + (start // line_bases) * line_width + start % line_bases
+        last_byte = offset + ((end - 1) // line_bases) * line_width + (end - 1) % line_bases
+        
+        chunk = _read_range(file_path, first_byte, last_byte - first_byte + 1)
+        return chunk.replace(b'\n', b'').replace(b'\r', b'').decode()
+
+    
+    def build_gzi_index(file_path) -> np.ndarray:
+        """Write the bgzip .gzi index: (compressed, uncompressed) start of every block after the first"""
+        with open(file_path, 'rb') as file:
+            blocks = np.array([(start, data_start) for start, _, data_start, _ in bgzf.BgzfBlocks(file)],
+                              dtype='<u8').reshape(-1, 2)
+        
+        entries = blocks[1:]
+        with open(_gzi_path(file_path), 'wb') as file:
+            file.write(np.array([len(entries)], dtype='<u8').tobytes())
+            file.write(entries.tobytes())
+        return blocks
+    
+    def load_gzi_index(file_path) -> np.ndarray:
+        """Block starts of a BGZF file as rows of (compressed, uncompressed) offsets, first block included"""
+        key = os.path.abspath(file_path)
+        mtime = os.path.getmtime(file_path)
+        
+        cached = _gzi_cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        
+        gzi_path = _gzi_path(file_path)
+        if os.path.exists(gzi_path) and os.path.getmtime(gzi_path) >= mtime:
+            with open(gzi_path, 'rb') as file:
+                count = int(np.frombuffer(file.read(8), dtype='<u8')[0])
+                entries = np.frombuffer(file.read(16 * count), dtype='<u8').reshape(-1, 2)
+            blocks = np.vstack([np.zeros((1, 2), dtype='<u8'), entries])
+        else:
+            blocks = FastaParser.build_gzi_index(file_path)
+        
+        _gzi_cache[key] = (mtime, blocks)
+        return blocks
+
+
+def _is_gzip(file_path) -> bool:
+    with open(file_path, 'rb') as file:
+        return file.read(2) == b'\x1f\x8b'
+
+
+def _is_bgzf(file_path) -> bool:
+    # a gzip member with an extra field carrying the 'BC' subfield
+    with open(file_path, 'rb') as file:
+        header = file.read(14)
+    return header[:4] == b'\x1f\x8b\x08\x04' and header[12:14] == b'BC'
+
+
+def _open_fasta(file_path, binary: bool = False):
+    """Open plain, gzip or BGZF FASTA files alike, compressed ones are decompressed while streaming"""
+    if _is_gzip(file_path):
+        return gzip.open(file_path, 'rb' if binary else 'rt')
+    return open(file_path, 'rb' if binary else 'r')
+
+
+def _read_range(file_path, position: int, size: int) -> bytes:
+    """Read size uncompressed bytes from position, jumping to the right block of BGZF files"""
+    if _is_bgzf(file_path):
+        blocks = FastaParser.load_gzi_index(file_path)
+        block = int(np.searchsorted(blocks[:, 1], position, side='right')) - 1
+        compressed_start, uncompressed_start = (int(v) for v in blocks[block])
+        with bgzf.BgzfReader(file_path, 'rb') as file:
+            file.seek(bgzf.make_virtual_offset(compressed_start, position - uncompressed_start))
+            return file.read(size)
+    
+    # plain gzip can only seek by decompressing everything before position
+    with _open_fasta(file_path, binary=True) as file:
+        file.seek(position)
+        return file.read(size)
+
+
+def _next_header(file, position: int) -> int:
+    """Byte offset of the first line starting with '>' at or after position, or the file size"""
+    if position == 0:
+        return 0
+    
+    # skip the rest of the line position falls in, unless it falls right at a line start
+    file.seek(position - 1)
+    if file.read(1) != b'\n':
+        file.readline()
+    while True:
+        line_start = file.tell()
+        line = file.readline()
+        if not line or line.startswith(b'>'):
+            return line_start
+
+
+def _parse_shard(file_path, start: int, end: int) -> tuple:
+    """Parse the records in file[start:end] straight from bytes"""
+    with open(file_path, 'rb') as file:
+        file.seek(start)
+        chunk = file.read(end - start)
+    return _parse_buffer(chunk)
+
+
+def _parse_buffer(buffer) -> tuple:
+    """Parse every record of a bytes-like buffer into columns, the buffer itself is never copied"""
+    raw = np.frombuffer(buffer, dtype=np.uint8)
+    
+    # headers are '>' at the start of a line, anything before the first one is ignored
+    newlines = np.flatnonzero(raw == ord('\n'))
+    line_starts = np.concatenate([[0], newlines + 1])
+    line_starts = line_starts[line_starts < len(raw)]
+    headers = line_starts[raw[line_starts] == ord('>')]
+    header_ends = np.concatenate([newlines, [len(raw)]])[np.searchsorted(newlines, headers)]
+    record_ends = np.append(headers[1:], len(raw))
+    
+    ids, descriptions, sequences, types, invalid = [], [], [], [], []
+    for header, header_end, record_end in zip(headers.tolist(), header_ends.tolist(), record_ends.tolist()):
+        parts = raw[header + 1:header_end].tobytes().decode().strip().split(maxsplit=1)
+        if not parts:
+            continue
+        sequence = raw[header_end:record_end].tobytes().translate(None, _WHITESPACE)
+        sequence_type, invalid_symbols = classify_sequence(sequence)
+        ids.append(parts[0])
+        descriptions.append(parts[1] if len(parts) > 1 else '')
+        sequences.append(sequence.decode())
+        types.append(sequence_type)
+        invalid.append(invalid_symbols)
+    
+    return ids, descriptions, sequences, types, invalid
+
+
+def _columns_to_dataframe(columns: tuple) -> pd.DataFrame:
+    df = pd.DataFrame(dict(zip(RECORD_COLUMNS, columns)), columns=RECORD_COLUMNS)
+    df.set_index('sequence_id', inplace=True)
+    return df
+
+
+def _decompressed_stream(stream):
+    # peek at the first bytes without consuming them, streams without peek get a buffer around them
+    if not hasattr(stream, 'peek'):
+        stream = io.BufferedReader(stream)
+    if stream.peek(2)[:2] == b'\x1f\x8b':
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def _index_path(file_path) -> str:
+    return f"{file_path}.fai"
+
+
+def _gzi_path(file_path) -> str:
+    return f"{file_path}.gzi"
+
+
+def _records_to_dataframe(records: List[Dict]) -> pd.DataFrame:
+    df = pd.DataFrame(records, columns=RECORD_COLUMNS)
+    df.set_index('sequence_id', inplace=True)
+    return df
@@ -1,8 +1,279 @@
-from Bio import pairwise2
-from typing import Dict, List
+import bisect
+import hashlib
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from Bio.Align import PairwiseAligner
+from typing import Callable, Dict, List, Optional
+from instrumentation import instrumented
+
+
+# 2-bit codes for the four canonical bases, 255 marks anything else
+_BASE_CODES = np.full(256, 255, dtype=np.uint8)
+_BASE_CODES[np.frombuffer(b'ACGT', dtype=np.uint8)] = np.arange(4, dtype=np.uint8)
+_CODE_BASES = np.frombuffer(b'ACGT', dtype=np.uint8)
+_CODE_SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+# byte -> the same byte with a-z folded to A-Z
+_UPPER_CASE = np.arange(256, dtype=np.uint8)
+_UPPER_CASE[ord('a'):ord('z') + 1] -= 32
+
+# how many of each 2-bit code a packed byte holds, used to count bases without unpacking
+_PACKED_CODE_COUNTS = np.stack(
+    [((np.arange(256)[:, None] >> _CODE_SHIFTS) & 3 == code).sum(axis=1) for code in range(4)],
+    axis=1
+)
+
+
+# symbol classes used to tell DNA, RNA and protein records apart from their bytes
+_SHARED_NUCLEOTIDE, _THYMINE, _URACIL, _IUPAC_AMBIGUITY, _PROTEIN_ONLY, _GAP, _INVALID = range(7)
+_SYMBOL_CLASSES = np.full(256, _INVALID, dtype=np.uint8)
+for _symbols, _symbol_class in ((b'ACGN', _SHARED_NUCLEOTIDE), (b'T', _THYMINE), (b'U', _URACIL),
+                                (b'RYSWKMBDHV', _IUPAC_AMBIGUITY), (b'EFIJLOPQXZ*', _PROTEIN_ONLY), (b'-.', _GAP)):
+    _codes = np.frombuffer(_symbols, dtype=np.uint8)
+    _SYMBOL_CLASSES[_codes] = _symbol_class
+    _SYMBOL_CLASSES[np.frombuffer(_symbols.lower(), dtype=np.uint8)] = _symbol_class
+
+# share of A/C/G/T/U/N above which a record is read as nucleotides
+NUCLEOTIDE_FRACTION = 0.9
+
+
+def classify_sequence(sequence) -> tuple:
+    """(sequence type, invalid symbol count) of one record from a single lookup and bincount over its bytes
+    
+    Records made (almost) only of A/C/G/T/U/N are nucleotides, RNA when they hold U but no T. Invalid
+    symbols are those outside the IUPAC alphabet of the detected type.
+    """
+    if isinstance(sequence, str):
+        sequence = sequence.encode('ascii', errors='replace')
+    raw = np.frombuffer(sequence, dtype=np.uint8)
+    counts = np.bincount(_SYMBOL_CLASSES[raw], minlength=7)
+    
+    nucleotides = counts[_SHARED_NUCLEOTIDE] + counts[_THYMINE] + counts[_URACIL]
+    if nucleotides >= NUCLEOTIDE_FRACTION * len(raw):
+        if counts[_URACIL] and not counts[_THYMINE]:
+            return "RNA", int(counts[_PROTEIN_ONLY] + counts[_INVALID])
+        return "DNA", int(counts[_URACIL] + counts[_PROTEIN_ONLY] + counts[_INVALID])
+    return "protein", int(counts[_INVALID])
+
+
+# IUPAC nucleotide codes and the bases each one stands for
+IUPAC_CODES = {
+    'A': 'A', 'C': 'C', 'G': 'G', 'T': 'T', 'U': 'T',
+    'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+    'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT'
+}
+
+
+def _pattern_masks(pattern: str, iupac: bool = False) -> Dict[str, int]:
+    #bit i of masks[c] is set when pattern[i] matches c, with iupac a code matches each of its bases (T and U alike)
+    masks = {}
+    for i, c in enumerate(pattern):
+        symbols = {c}
+        if iupac and c in IUPAC_CODES:
+            symbols.update(IUPAC_CODES[c])
+            if 'T' in symbols:
+                symbols.add('U')
+        for symbol in symbols:
+            masks[symbol] = masks.get(symbol, 0) | (1 << i)
+    return masks
+
+
+def _shift_and_mismatches(pattern: str, text: str, max_errors: int, iupac: bool = False):
+    """Yield (start, mismatches) of every window of text within max_errors substitutions of pattern"""
+    masks = _pattern_masks(pattern, iupac)
+    m = len(pattern)
+    found = 1 << (m - 1)
+    # states[d] has bit i set when pattern[:i+1] matches the text ending here with at most d mismatches
+    states = [0] * (max_errors + 1)
+    
+    for j, c in enumerate(text):
+        mask = masks.get(c, 0)
+        previous = states[0]
+        states[0] = ((previous << 1) | 1) & mask
+        for d in range(1, max_errors + 1):
+            current = states[d]
+            states[d] = (((current << 1) | 1) & mask) | ((previous << 1) | 1)
+            previous = current
+        
+        if j >= m - 1 and states[max_errors] & found:
+            yield j - m + 1, next(d for d in range(max_errors + 1) if states[d] & found)
+
+
+def _myers_search(pattern: str, text: str, max_errors: int, anchored: bool = False, iupac: bool = False):
+    """Yield (end, edit distance) wherever pattern matches text ending at end with at most max_errors edits"""
+    masks = _pattern_masks(pattern, iupac)
+    m = len(pattern)
+    all_ones = (1 << m) - 1
+    high_bit = 1 << (m - 1)
+    # anchored alignments must start at text[0], so the top row grows by one per column
+    carry = 1 if anchored else 0
+    positive, negative, score = all_ones, 0, m
+    
+    for j, c in enumerate(text):
+        eq = masks.get(c, 0)
+        xv = eq | negative
+        xh = (((eq & positive) + positive) ^ positive) | eq
+        horizontal_positive = negative | (~(xh | positive) & all_ones)
+        horizontal_negative = positive & xh
+        
+        if horizontal_positive & high_bit:
+            score += 1
+        elif horizontal_negative & high_bit:
+            score -= 1
+        
+        horizontal_positive = ((horizontal_positive << 1) | carry) & all_ones
+        horizontal_negative = (horizontal_negative << 1) & all_ones
+        positive = horizontal_negative | (~(xv | horizontal_positive) & all_ones)
+        negative = horizontal_positive & xv
+        
+        if score <= max_errors:
+            yield j, score
+
+
+def _kmer_codes(sequence: str, k: int):
+    """2-bit integer code of every k-mer (k <= 32) and whether it contains only ACGT, in either case"""
+    raw = np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)
+    n_kmers = len(raw) - k + 1
+    if n_kmers <= 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=bool)
+    
+    # soft-masked (lower case) bases seed anchors like upper case ones
+    codes = _BASE_CODES[_UPPER_CASE[raw]]
+    invalid = np.concatenate([[0], np.cumsum(codes == 255)])
+    valid = invalid[k:] - invalid[:n_kmers] == 0
+    
+    codes = codes.astype(np.uint64) & np.uint64(3)
+    kmers = np.zeros(n_kmers, dtype=np.uint64)
+    for i in range(k):
+        kmers = (kmers << np.uint64(2)) | codes[i:i + n_kmers]
+    return kmers, valid
+
+
+def _unique_kmer_positions(sequence: str, k: int):
+    kmers, valid = _kmer_codes(sequence, k)
+    positions = np.flatnonzero(valid)
+    values, first, counts = np.unique(kmers[positions], return_index=True, return_counts=True)
+    unique = counts == 1
+    return values[unique], positions[first[unique]]
+
+
+def _chain_anchors(seq1: str, seq2: str, k: int) -> List[tuple]:
+    """Collinear exact segments (start1, start2, length) built from k-mers unique in both sequences"""
+    values1, positions1 = _unique_kmer_positions(seq1, k)
+    values2, positions2 = _unique_kmer_positions(seq2, k)
+    _, in1, in2 = np.intersect1d(values1, values2, assume_unique=True, return_indices=True)
+    anchors1, anchors2 = positions1[in1], positions2[in2]
+    order = np.argsort(anchors1)
+    anchors1, anchors2 = anchors1[order].tolist(), anchors2[order].tolist()
+    
+    # longest chain increasing in both sequences (patience sorting on the second coordinate)
+    tails, tail_index, previous = [], [], [-1] * len(anchors1)
+    for i, position in enumerate(anchors2):
+        slot = bisect.bisect_left(tails, position)
+        previous[i] = tail_index[slot - 1] if slot else -1
+        if slot == len(tails):
+            tails.append(position)
+            tail_index.append(i)
+        else:
+            tails[slot] = position
+            tail_index[slot] = i
+    chain = []
+    i = tail_index[-1] if tail_index else -1
+    while i != -1:
+        chain.append(i)
+        i = previous[i]
+    chain.reverse()
+    
+    # overlapping anchors on one diagonal merge into a segment, crossing ones are dropped
+    segments = []
+    for i in chain:
+        start1, start2 = anchors1[i], anchors2[i]
+        if segments:
+            last1, last2, length = segments[-1]
+            if start1 - start2 == last1 - last2 and start1 <= last1 + length:
+                segments[-1] = (last1, last2, start1 + k - last1)
+                continue
+            if start1 < last1 + length or start2 < last2 + length:
+                continue
+        segments.append((start1, start2, k))
+    return segments
+
+
+def _gap_cells(segments: List[tuple]) -> int:
+    #DP cells filled between consecutive segments, the last one closes the alignment at the two ends
+    cells = 0
+    end1 = end2 = 0
+    for start1, start2, length in segments:
+        cells += (start1 - end1) * (start2 - end2)
+        end1, end2 = start1 + length, start2 + length
+    return cells
+
+
+# per-process state of the pairwise_matrix workers, set once by the pool initializer
+_pair_worker = {}
+
+
+def _init_pair_worker(sequences: List[str], scoring: Dict, method: str, score_only: bool):
+    _pair_worker['sequences'] = sequences
+    _pair_worker['aligner'] = BioPythonAligner(**scoring)
+    _pair_worker['method'] = method
+    _pair_worker['score_only'] = score_only
+
+
+def _align_pairs(pairs: List[tuple]) -> List[tuple]:
+    sequences = _pair_worker['sequences']
+    aligner = _pair_worker['aligner']
+    method = _pair_worker['method']
+    
+    results = []
+    for i, j in pairs:
+        if _pair_worker['score_only']:
+            results.append((aligner.score_sequences(sequences[i], sequences[j], method), np.nan))
+        else:
+            alignment = aligner.align_sequences(sequences[i], sequences[j], method)
+            results.append((alignment['score'], alignment['percent_identity']))
+    return results
+
+
+def _match_line(aligned_seq1: str, aligned_seq2: str) -> str:
+    """'|' where the columns are identical, ' ' against a gap and '.' for a mismatch, compared as byte arrays"""
+    row1 = np.frombuffer(aligned_seq1.encode('ascii'), dtype=np.uint8)
+    row2 = np.frombuffer(aligned_seq2.encode('ascii'), dtype=np.uint8)
+    gap = ord('-')
+    
+    line = np.where(row1 == row2, ord('|'), np.where((row1 == gap) | (row2 == gap), ord(' '), ord('.')))
+    return line.astype(np.uint8).tobytes().decode('ascii')
+
+
+def _alignment_result(aligned_seq1: str, aligned_seq2: str, score: float) -> Dict:
+    """Result dict shared by every alignment method"""
+    row1 = np.frombuffer(aligned_seq1.encode('ascii'), dtype=np.uint8)
+    row2 = np.frombuffer(aligned_seq2.encode('ascii'), dtype=np.uint8)
+    gap = ord('-')
+    
+    # Calculate matches and gaps
+    matches = int(np.count_nonzero((row1 == row2) & (row1 != gap)))
+    gaps = int(np.count_nonzero(row1 == gap) + np.count_nonzero(row2 == gap))
+    
+    return {
+        'aligned_seq1': aligned_seq1,
+        'aligned_seq2': aligned_seq2,
+        'score': score,
+        'matches': matches,
+        'gaps': gaps,
+        'length': len(aligned_seq1),
+        'percent_identity': (matches / len(aligned_seq1)) * 100 if aligned_seq1 else 0.0
+    }
 
 
 class Gene: 
+    __slots__ = ('__sequence_id', '__sequence_description', '__sequence')
+    
+    # approximate motifs may use IUPAC codes, only nucleotide sequences turn this on
+    IUPAC_MOTIFS = False
+    
     def __init__(self, sequence_id:str, sequence_description:str, sequence:str):
         self.__sequence_id = sequence_id
         self.__sequence_description = sequence_description
@@ -34,13 +305,16 @@ class Gene:
     
     
     #return all the positions where a certain motif occur
+    @instrumented
     def find_motif(self, motif: str):
 
         motif = motif.upper()
+        # bound once, a packed sequence is unpacked on every access to .sequence
+        sequence = self.sequence
         positions = []
         loc = 0
         while True:
-            loc = self.sequence.find(motif, loc)        #gives back the location of where it found the motif
+            loc = sequence.find(motif, loc)        #gives back the location of where it found the motif
             if loc == -1:
                 break
             positions.append(loc)
@@ -48,118 +322,446 @@ class Gene:
         return positions
     
     
+    #return (start, end, errors) for every occurrence of motif within max_errors mismatches or edits
+    @instrumented
+    def find_approximate_motif(self, motif: str, max_errors: int = 1, edits: bool = False):
+        """Bit-parallel approximate search, shift-and for mismatches and Myers' algorithm for edits
+        
+        On DNA and RNA sequences an IUPAC code in the motif matches every base it stands for at no cost.
+        """
+        motif = motif.upper()
+        if not motif:
+            raise ValueError("Motif must not be empty")
+        if max_errors < 0:
+            raise ValueError("max_errors must be zero or positive")
+        
+        sequence = self.sequence
+        iupac = self.IUPAC_MOTIFS
+        if not edits:
+            return [
+                (start, start + len(motif), errors)
+                for start, errors in _shift_and_mismatches(motif, sequence, max_errors, iupac)
+            ]
+        
+        # an occurrence within k edits also matches at the ends around it, every run of adjacent ends is one
+        # occurrence reported at its best end
+        clusters = []
+        for end, errors in _myers_search(motif, sequence, max_errors, iupac=iupac):
+            if clusters and end == clusters[-1][2] + 1:
+                best_end, best_errors, _ = clusters[-1]
+                clusters[-1] = (end, errors, end) if errors < best_errors else (best_end, best_errors, end)
+            else:
+                clusters.append((end, errors, end))
+        
+        hits = []
+        for end, errors, _ in clusters:
+            # the end is known, run the search backwards from it to find where the best match begins
+            window = sequence[max(0, end + 1 - len(motif) - max_errors):end + 1][::-1]
+            best = min(_myers_search(motif[::-1], window, max_errors, anchored=True, iupac=iupac), key=lambda hit: hit[1])
+            hits.append((end - best[0], end + 1, errors))
+        return hits
+    
+    
     #relative frequency of each nucleotide base
     def base_composition_percentage(self):
         base_comp=self.base_composition()
         for key in base_comp:     
-            base_comp[key] = base_comp[key]/len(self.sequence)*100
+            base_comp[key] = base_comp[key]/self.sequence_length()*100
         return base_comp
     
     
     
+def _runs(mask: np.ndarray, values: Optional[np.ndarray] = None, dtype=np.int64):
+    #(starts, ends) of the runs of consecutive True in mask, a run also ends wherever values changes
+    positions = np.flatnonzero(mask)
+    if not len(positions):
+        return np.zeros(0, dtype=dtype), np.zeros(0, dtype=dtype)
+    breaks = np.diff(positions) != 1
+    if values is not None:
+        breaks |= np.diff(values[positions]) != 0
+    first = np.concatenate([[0], np.flatnonzero(breaks) + 1])
+    last = np.concatenate([first[1:], [len(positions)]]) - 1
+    return positions[first].astype(dtype), (positions[last] + 1).astype(dtype)
+
+
+def _expand_runs(starts: np.ndarray, ends: np.ndarray, lo: int, hi: int):
+    #(positions relative to lo, run of each position) of every position of the runs inside [lo, hi)
+    first = int(np.searchsorted(ends, lo, side='right'))
+    last = int(np.searchsorted(starts, hi, side='left'))
+    run_starts = np.maximum(starts[first:last], lo).astype(np.int64) - lo
+    lengths = np.minimum(ends[first:last], hi).astype(np.int64) - lo - run_starts
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.arange(int(lengths.sum()), dtype=np.int64) + np.repeat(run_starts - offsets, lengths)
+    return positions, np.repeat(np.arange(first, last), lengths)
+
+
 class DNASequence(Gene):
+    """DNA sequence stored 2-bit packed
+    
+    Lower case and non-ACGT symbols (N, IUPAC codes, ...) are kept as runs, so a soft-masked region or a
+    stretch of N costs a few bytes however long it is.
+    """
+    __slots__ = ('__packed', '__length', '__exception_starts', '__exception_ends', '__exception_bytes',
+                 '__lower_starts', '__lower_ends')
+    IUPAC_MOTIFS = True
+    
+    def __init__(self, sequence_id:str, sequence_description:str, sequence:str):
+        super().__init__(sequence_id, sequence_description, None)
+        
+        raw = np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)
+        upper = _UPPER_CASE[raw]
+        codes = _BASE_CODES[upper]
+        dtype = np.int32 if len(raw) < 2 ** 31 else np.int64
+        
+        # case is folded before packing, the lower case runs are enough to restore it
+        self.__lower_starts, self.__lower_ends = _runs(raw != upper, dtype=dtype)
+        
+        # runs of one non-ACGT symbol are stored apart and packed as 'A'
+        exceptions = codes == 255
+        self.__exception_starts, self.__exception_ends = _runs(exceptions, upper, dtype=dtype)
+        self.__exception_bytes = upper[self.__exception_starts]
+        codes[exceptions] = 0
+        
+        self.__length = len(raw)
+        codes = np.concatenate([codes, np.zeros(-len(codes) % 4, dtype=np.uint8)]).reshape(-1, 4)
+        self.__packed = np.bitwise_or.reduce(codes << _CODE_SHIFTS, axis=1).astype(np.uint8)
+    
+    @property
+    def sequence(self):
+        return self.extract_subsequences()
+    
+    def sequence_length(self):
+        return self.__length
+    
+    def extract_subsequences(self, start=None, end=None):
+        """Extract a subsequence from the DNA sequence, unpacking only the bytes it covers"""
+        start, end, _ = slice(start, end).indices(self.__length)
+        if start >= end:
+            return ''
+        
+        block = self.__packed[start // 4:(end + 3) // 4]
+        codes = ((block[:, None] >> _CODE_SHIFTS) & 3).ravel()
+        bases = _CODE_BASES[codes[start % 4:start % 4 + end - start]]
+        
+        # put back the non-ACGT symbols and the lower case falling inside the window
+        positions, runs = _expand_runs(self.__exception_starts, self.__exception_ends, start, end)
+        bases[positions] = self.__exception_bytes[runs]
+        positions, _ = _expand_runs(self.__lower_starts, self.__lower_ends, start, end)
+        bases[positions] |= 0x20
+        
+        return bases.tobytes().decode('ascii')
          
     #percentage of GC content
     def GC_content_percentage(self):
-        sequence=self.sequence
-        GC_count=sequence.count('G') + sequence.count('C')
-        return f"{(GC_count/len(sequence))*100}%"
+        base_comp=self.base_composition()
+        GC_count=base_comp['G'] + base_comp['C']
+        return f"{(GC_count/self.sequence_length())*100}%"
 
     
     #absolute frequency of each nucleotide base
+    @instrumented
     def base_composition(self):
+        
+        counts = np.bincount(self.__packed, minlength=256) @ _PACKED_CODE_COUNTS
+        # padding and exceptions were packed as 'A'
+        exceptions = int((self.__exception_ends - self.__exception_starts).sum())
+        counts[0] -= len(self.__packed) * 4 - self.__length + exceptions
 
         return {
-            'A': self.sequence.count('A'),
-            'C': self.sequence.count('C'),
-            'G': self.sequence.count('G'),
-            'T': self.sequence.count('T')
+            'A': int(counts[0]),
+            'C': int(counts[1]),
+            'G': int(counts[2]),
+            'T': int(counts[3])
         }
 
 
         
         
+class RNASequence(Gene):
+    __slots__ = ()
+    IUPAC_MOTIFS = True
+    
+    #percentage of GC content
+    def GC_content_percentage(self):
+        sequence=self.sequence.upper()
+        GC_count=sequence.count('G') + sequence.count('C')
+        return f"{(GC_count/len(sequence))*100}%"
+    
+    #absolute frequency of each nucleotide base, lower case counted like upper case
+    @instrumented
+    def base_composition(self):
+        sequence=self.sequence.upper()
+
+        return {
+            'A': sequence.count('A'),
+            'C': sequence.count('C'),
+            'G': sequence.count('G'),
+            'U': sequence.count('U')
+        }
+
+
 class AmminoacidsSequence(Gene):
+    __slots__ = ()
     
         
-    #absolute frequency of each nucleotide base
+    #absolute frequency of each amino acid, lower case counted like upper case
+    @instrumented
     def base_composition(self):
+        sequence=self.sequence.upper()
 
         return {
-            'G': self.sequence.count('G'),
-            'A': self.sequence.count('A'),
-            'V': self.sequence.count('V'),
-            'L': self.sequence.count('L'),
-            'I': self.sequence.count('I'),
-            'D': self.sequence.count('D'),
-            'E': self.sequence.count('E'),
-            'N': self.sequence.count('N'),
-            'Q': self.sequence.count('Q'),
-            'P': self.sequence.count('P'),
-            'F': self.sequence.count('F'),
-            'W': self.sequence.count('W'),
-            'K': self.sequence.count('K'),
-            'C': self.sequence.count('C'),
-            'M': self.sequence.count('M'),
-            'Y': self.sequence.count('Y'),
-            'R': self.sequence.count('R'),
-            'H': self.sequence.count('H'),
-            'S': self.sequence.count('S'),
-            'T': self.sequence.count('T')
+            'G': sequence.count('G'),
+            'A': sequence.count('A'),
+            'V': sequence.count('V'),
+            'L': sequence.count('L'),
+            'I': sequence.count('I'),
+            'D': sequence.count('D'),
+            'E': sequence.count('E'),
+            'N': sequence.count('N'),
+            'Q': sequence.count('Q'),
+            'P': sequence.count('P'),
+            'F': sequence.count('F'),
+            'W': sequence.count('W'),
+            'K': sequence.count('K'),
+            'C': sequence.count('C'),
+            'M': sequence.count('M'),
+            'Y': sequence.count('Y'),
+            'R': sequence.count('R'),
+            'H': sequence.count('H'),
+            'S': sequence.count('S'),
+            'T': sequence.count('T')
         }
 
     
           
 
+SEQUENCE_CLASSES = {
+    "DNA": DNASequence,
+    "RNA": RNASequence,
+    "protein": AmminoacidsSequence
+}
+
+
 class BioPythonAligner:
-    def align_sequences(self, seq1: str, seq2: str, method: str = 'global') -> Dict:
+    def __init__(self, match_score: float = 2, mismatch_score: float = -1,
+                 open_gap_score: float = -0.5, extend_gap_score: float = -0.1):
+        self.match_score = match_score
+        self.mismatch_score = mismatch_score
+        self.open_gap_score = open_gap_score
+        self.extend_gap_score = extend_gap_score
+    
+    def scoring(self) -> Dict[str, float]:
+        return {
+            'match_score': self.match_score,
+            'mismatch_score': self.mismatch_score,
+            'open_gap_score': self.open_gap_score,
+            'extend_gap_score': self.extend_gap_score
+        }
+    
+    def _aligner(self, method: str) -> PairwiseAligner:
+        if method == 'seeded':
+            method = 'global'
+        if method not in ('global', 'local'):
+            raise ValueError(f"Unknown alignment method '{method}'")
+        
+        return PairwiseAligner(mode=method, **self.scoring())
+    
+    @instrumented
+    def score_sequences(self, seq1: str, seq2: str, method: str = 'global') -> float:
+        """Optimal alignment score only, computed in linear memory without a traceback"""
+        return self._aligner(method).score(seq1, seq2)
+    
+    @instrumented
+    def align_sequences(self, seq1: str, seq2: str, method: str = 'global', seed_length: int = 15,
+                        max_cells: Optional[int] = None) -> Dict:
+        """Best alignment of seq1 and seq2, max_cells refuses (ValueError) a pair whose DP would fill more cells"""
+        if method == 'seeded':
+            return self._align_seeded(seq1, seq2, seed_length, max_cells)
+        
+        self._check_cells(len(seq1) * len(seq2), max_cells)
 
-        # Perform alignment
-        align_func = pairwise2.align.globalms if method == 'global' else pairwise2.align.localms
-        alignments = align_func(seq1, seq2, 2, -1, -0.5, -0.1)  # Default scoring
+        # Alignments are enumerated lazily, so only the first traceback is ever built
+        alignment = next(iter(self._aligner(method).align(seq1, seq2)), None)
         
-        if not alignments:
+        if alignment is None:
             raise ValueError("No alignments found")
 
-        # Get best alignment
-        aligned_seq1, aligned_seq2, score, start, end = alignments[0]
+        return _alignment_result(alignment[0], alignment[1], alignment.score)
 
-        # Calculate matches and gaps
-        matches = sum(1 for a, b in zip(aligned_seq1, aligned_seq2) if a == b)
-        gaps = aligned_seq1.count('-') + aligned_seq2.count('-')
+    def _align_seeded(self, seq1: str, seq2: str, seed_length: int, max_cells: Optional[int] = None) -> Dict:
+        """Global alignment that keeps exact anchors fixed and runs DP only in the gaps between them
+        
+        Each gap gets a full, unbanded global DP, so the cost is the sum of the gap areas: small for similar
+        sequences, the whole len(seq1) * len(seq2) when they share no anchor.
+        """
+        segments = _chain_anchors(seq1, seq2, seed_length) + [(len(seq1), len(seq2), 0)]
+        self._check_cells(_gap_cells(segments), max_cells)
+        aligner = self._aligner('global')
+        rows1, rows2 = [], []
+        end1 = end2 = 0
+        
+        for start1, start2, length in segments:
+            gap1, gap2 = seq1[end1:start1], seq2[end2:start2]
+            if gap1 and gap2:
+                alignment = next(iter(aligner.align(gap1, gap2)))
+                rows1.append(alignment[0])
+                rows2.append(alignment[1])
+            else:
+                rows1.append(gap1 or '-' * len(gap2))
+                rows2.append(gap2 or '-' * len(gap1))
+            
+            rows1.append(seq1[start1:start1 + length])
+            rows2.append(seq2[start2:start2 + length])
+            end1, end2 = start1 + length, start2 + length
+        
+        aligned_seq1, aligned_seq2 = ''.join(rows1), ''.join(rows2)
+        return _alignment_result(aligned_seq1, aligned_seq2, self._alignment_score(aligned_seq1, aligned_seq2))
+    
+    def seeded_cells(self, seq1: str, seq2: str, seed_length: int = 15) -> int:
+        """DP cells a seeded alignment fills, the summed areas of the gaps between its anchors"""
+        return _gap_cells(_chain_anchors(seq1, seq2, seed_length) + [(len(seq1), len(seq2), 0)])
+    
+    @staticmethod
+    def _check_cells(cells: int, max_cells: Optional[int]):
+        if max_cells is not None and cells > max_cells:
+            raise ValueError(f"Alignment needs {cells:,} DP cells, more than the limit of {max_cells:,}")
+    
+    def _alignment_score(self, aligned_seq1: str, aligned_seq2: str) -> float:
+        """Score of a finished alignment under the affine gap scoring of this aligner"""
+        row1 = np.frombuffer(aligned_seq1.encode('ascii'), dtype=np.uint8)
+        row2 = np.frombuffer(aligned_seq2.encode('ascii'), dtype=np.uint8)
+        gap = ord('-')
+        gap1, gap2 = row1 == gap, row2 == gap
+        aligned = ~gap1 & ~gap2
+        matches = np.count_nonzero(aligned & (row1 == row2))
+        mismatches = np.count_nonzero(aligned) - matches
+        
+        # every run of gap characters in a row opens once and extends for the rest
+        gap_chars = np.count_nonzero(gap1) + np.count_nonzero(gap2)
+        gap_runs = sum(np.count_nonzero(np.diff(np.concatenate([[0], g.astype(np.int8)])) == 1) for g in (gap1, gap2))
+        
+        return (matches * self.match_score + mismatches * self.mismatch_score
+                + gap_runs * self.open_gap_score + (gap_chars - gap_runs) * self.extend_gap_score)
+    
+    @instrumented
+    def pairwise_matrix(self, sequences: List[str], method: str = 'global', query: Optional[int] = None,
+                        score_only: bool = False, workers: Optional[int] = None, chunk_size: int = 64,
+                        progress: Optional[Callable[[int, int], None]] = None,
+                        checkpoint_path: Optional[str] = None, checkpoint_interval: float = 30.0) -> Dict[str, np.ndarray]:
+        """Score, identity and distance for all pairs (condensed, scipy pdist order) or one query against all
+        
+        Sequences are sent to each worker process once, tasks only carry pair indices. With a
+        checkpoint_path finished pairs are saved every checkpoint_interval seconds and at the end, and are
+        skipped when the call is repeated; an interruption loses at most the last interval.
+        """
+        self._aligner(method)
+        n = len(sequences)
+        if query is None:
+            first, second = np.triu_indices(n, k=1)
+        else:
+            second = np.array([j for j in range(n) if j != query], dtype=np.int64)
+            first = np.full(len(second), query, dtype=np.int64)
+        
+        size = n if query is not None else len(first)
+        # pair k fills slot k, a query against all fills the slot of the other sequence
+        slots = second if query is not None else np.arange(len(first))
+        scores = np.full(size, np.nan)
+        identities = np.full(size, np.nan)
+        done = np.zeros(size, dtype=bool)
+        if query is not None:
+            done[query] = True
+        
+        signature = self._pairwise_signature(sequences, method, query, score_only)
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with np.load(checkpoint_path) as checkpoint:
+                if str(checkpoint['signature']) != signature:
+                    raise ValueError(f"Checkpoint {checkpoint_path} was written for a different run")
+                scores, identities, done = checkpoint['score'], checkpoint['percent_identity'], checkpoint['done']
+        
+        todo = np.flatnonzero(~done[slots])
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        total = len(slots)
+        completed = total - len(todo)
+        
+        last_saved = time.monotonic()
+        
+        def store(chunk, results):
+            nonlocal completed, last_saved
+            for k, (score, identity) in zip(chunk, results):
+                scores[slots[k]] = score
+                identities[slots[k]] = identity
+                done[slots[k]] = True
+            completed += len(chunk)
+            # the whole arrays are rewritten on every save, so saves are spaced out in time
+            if checkpoint_path and time.monotonic() - last_saved >= checkpoint_interval:
+                self._save_checkpoint(checkpoint_path, signature, scores, identities, done)
+                last_saved = time.monotonic()
+            if progress:
+                progress(completed, total)
+        
+        init_args = (sequences, self.scoring(), method, score_only)
+        try:
+            if workers == 1 or len(chunks) <= 1:
+                _init_pair_worker(*init_args)
+                for chunk in chunks:
+                    store(chunk, _align_pairs(list(zip(first[chunk], second[chunk]))))
+            else:
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_pair_worker, initargs=init_args) as pool:
+                    futures = {
+                        pool.submit(_align_pairs, list(zip(first[chunk], second[chunk]))): chunk
+                        for chunk in chunks
+                    }
+                    for future in as_completed(futures):
+                        store(futures[future], future.result())
+        finally:
+            # a finished, failed or cancelled run keeps every pair completed so far
+            if checkpoint_path and todo.size:
+                self._save_checkpoint(checkpoint_path, signature, scores, identities, done)
         
         return {
-            'aligned_seq1': aligned_seq1,
-            'aligned_seq2': aligned_seq2,
-            'score': score,
-            'matches': matches,
-            'gaps': gaps,
-            'length': len(aligned_seq1),
-            'percent_identity': (matches / len(aligned_seq1)) * 100
+            'score': scores,
+            'percent_identity': identities,
+            'distance': 1 - identities / 100
         }
+    
+    def _pairwise_signature(self, sequences, method, query, score_only) -> str:
+        digest = hashlib.sha1(repr((sorted(self.scoring().items()), method, query, score_only)).encode())
+        for sequence in sequences:
+            digest.update(sequence.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def _save_checkpoint(self, path, signature, scores, identities, done):
+        # written next to the target and renamed, so an interrupted run never leaves a broken file
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'wb') as file:
+            np.savez(file, signature=signature, score=scores, percent_identity=identities, done=done)
+        os.replace(temp_path, path)
 
-    def format_alignment(self, alignment_result: Dict, window_size: int = 60) -> List[Dict]:
-        """Format alignment into blocks for display"""
+    @instrumented
+    def format_alignment(self, alignment_result: Dict, window_size: int = 60,
+                         start: int = 0, end: Optional[int] = None) -> List[Dict]:
+        """Format columns start..end of the alignment into blocks of window_size for display
+
+        Only the requested columns are sliced and compared, so the cost depends on the window and not on the
+        length of the alignment. The defaults format the whole alignment.
+        """
         seq1 = alignment_result['aligned_seq1']
         seq2 = alignment_result['aligned_seq2']
-        blocks = []
+        end = len(seq1) if end is None else min(end, len(seq1))
+        start = max(0, start)
+        if start >= end:
+            return []
 
-        for i in range(0, len(seq1), window_size):
-            block_seq1 = seq1[i:i+window_size]
-            block_seq2 = seq2[i:i+window_size]
-            
-            # Generate match line for current block
-            match_line = ''.join('|' if a == b else ' ' if a == '-' or b == '-' else '.'
-                               for a, b in zip(block_seq1, block_seq2))
-            
+        match_line = _match_line(seq1[start:end], seq2[start:end])
+        blocks = []
+        for i in range(start, end, window_size):
+            block_end = min(i + window_size, end)
             blocks.append({
                 'position': i,
-                'seq1': block_seq1,
-                'match': match_line,
-                'seq2': block_seq2
+                'seq1': seq1[i:block_end],
+                'match': match_line[i - start:block_end - start],
+                'seq2': seq2[i:block_end]
             })
 
         return blocks
-
-    
-    
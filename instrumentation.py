@@ -0,0 +1,171 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+
+class MetricsRegistry:
+    """Wall time, call count and peak traced memory of every named stage, shared by all threads"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, peak_bytes: Optional[int] = None):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = {
+                    'calls': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'last_seconds': 0.0, 'peak_bytes': None
+                }
+            metric['calls'] += 1
+            metric['total_seconds'] += seconds
+            metric['max_seconds'] = max(metric['max_seconds'], seconds)
+            metric['last_seconds'] = seconds
+            if peak_bytes is not None:
+                metric['peak_bytes'] = max(metric['peak_bytes'] or 0, peak_bytes)
+
+    def snapshot(self) -> List[Dict]:
+        """One row per stage, slowest in total first"""
+        with self._lock:
+            rows = [
+                dict(metric, stage=name, mean_seconds=metric['total_seconds'] / metric['calls'])
+                for name, metric in self._metrics.items()
+            ]
+        return sorted(rows, key=lambda row: row['total_seconds'], reverse=True)
+
+    def to_json(self) -> str:
+        return json.dumps({'stages': self.snapshot()}, indent=2)
+
+    def reset(self):
+        with self._lock:
+            self._metrics.clear()
+
+
+registry = MetricsRegistry()
+
+# read on every instrumented call, a plain attribute lookup is all a disabled stage costs
+_config = {'enabled': False, 'trace_memory': False}
+
+# stages open in each thread, every frame is [traced memory at entry, highest peak seen so far]
+_frames = threading.local()
+# threads inside a memory-traced stage, tracemalloc runs while this is above zero
+_tracing = {'active': 0, 'owned': False}
+_tracing_lock = threading.Lock()
+
+
+def enable(trace_memory: bool = True):
+    """Start recording, trace_memory also records tracemalloc peaks at the price of slower allocation"""
+    _config['trace_memory'] = trace_memory
+    _config['enabled'] = True
+
+
+def disable():
+    _config['enabled'] = False
+
+
+def is_enabled() -> bool:
+    return _config['enabled']
+
+
+def _start_tracing():
+    with _tracing_lock:
+        if _tracing['active'] == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing['owned'] = True
+        _tracing['active'] += 1
+
+
+def _stop_tracing():
+    with _tracing_lock:
+        _tracing['active'] -= 1
+        # tracing somebody else started is left alone
+        if _tracing['active'] == 0 and _tracing['owned']:
+            tracemalloc.stop()
+            _tracing['owned'] = False
+
+
+class _Stage:
+    __slots__ = ('name', 'trace_memory', 'start')
+
+    def __init__(self, name: str, trace_memory: bool):
+        self.name = name
+        self.trace_memory = trace_memory
+
+    def __enter__(self):
+        if self.trace_memory:
+            _start_tracing()
+            frames = _frames.__dict__.setdefault('stack', [])
+            current, peak = tracemalloc.get_traced_memory()
+            if frames:
+                # the peak is about to be reset, the enclosing stage keeps what it reached so far
+                frames[-1][1] = max(frames[-1][1], peak)
+            tracemalloc.reset_peak()
+            frames.append([current, current])
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        peak_bytes = None
+        if self.trace_memory:
+            frames = _frames.stack
+            start_current, highest = frames.pop()
+            highest = max(highest, tracemalloc.get_traced_memory()[1])
+            if frames:
+                frames[-1][1] = max(frames[-1][1], highest)
+            peak_bytes = highest - start_current
+            _stop_tracing()
+        registry.record(self.name, seconds, peak_bytes)
+        return False
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str):
+    """with stage('plot'): ... records the block under name, a shared no-op when instrumentation is off"""
+    if not _config['enabled']:
+        return _NO_STAGE
+    return _Stage(name, _config['trace_memory'])
+
+
+def instrumented(name=None):
+    """Decorator recording every call as a stage, named after the function unless a name is given
+
+    Works bare (@instrumented) or with a name (@instrumented('parse')).
+    """
+    def decorate(func: Callable, label: Optional[str] = None):
+        label = label or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _config['enabled']:
+                return func(*args, **kwargs)
+            with _Stage(label, _config['trace_memory']):
+                return func(*args, **kwargs)
+        return wrapper
+
+    if callable(name):
+        return decorate(name)
+    return lambda func: decorate(func, name)
+
+
+# SEQUENCE_ANALYSIS_METRICS=1 records from startup, =time skips the memory tracing
+if os.environ.get('SEQUENCE_ANALYSIS_METRICS', '').lower() in ('1', 'true', 'memory'):
+    enable()
+elif os.environ.get('SEQUENCE_ANALYSIS_METRICS', '').lower() == 'time':
+    enable(trace_memory=False)
@@ -0,0 +1,277 @@
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+from gene_classes import SEQUENCE_CLASSES, BioPythonAligner, Gene
+from motif_search import MotifIndex
+from sketch import MinHashSketches
+
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    """Handed to a task in the worker process, reports progress and sees cancellation requests
+
+    Only holds proxies of the manager process, so it pickles cheaply into any worker.
+    """
+
+    def __init__(self, job_id: str, progress, cancel_event):
+        self.job_id = job_id
+        self._progress = progress
+        self._cancel_event = cancel_event
+
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def progress(self, done: int, total: int):
+        """Record done out of total steps, raises JobCancelled once the job was cancelled"""
+        self._progress[self.job_id] = (done, total)
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.job_id)
+
+
+def _run_job(task: Callable, context: JobContext, args: tuple, kwargs: Dict):
+    # (0, 0) tells the parent the job left the queue
+    context.progress(0, 0)
+    return task(context, *args, **kwargs)
+
+
+class Job:
+    __slots__ = ('job_id', 'key', 'name', 'state', 'submitted', 'started', 'finished',
+                 'result', 'error', 'future', 'cancel_event', 'on_done')
+
+    def __init__(self, job_id: str, key: Optional[str], name: str, on_done: Optional[Callable]):
+        self.job_id = job_id
+        self.key = key
+        self.name = name
+        self.state = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.future = None
+        self.cancel_event = None
+        self.on_done = on_done
+
+
+class JobManager:
+    """Runs long analyses on a shared process pool, each job has an id, progress, and can be cancelled
+
+    At most max_running jobs execute at once, the rest wait in the pool's queue, and submissions beyond
+    max_pending unfinished jobs are refused. Jobs submitted with a key are deduplicated, so a page asking
+    again for the same analysis gets the job that is already queued, running or done. Finished jobs keep
+    their result until max_finished newer ones have completed.
+    """
+
+    def __init__(self, max_running: int = 2, max_pending: int = 16, max_finished: int = 64):
+        self.max_running = max_running
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._jobs: Dict[str, Job] = OrderedDict()
+        self._by_key: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        self._pool = None
+        self._manager = None
+        self._progress = None
+
+    def _start(self):
+        # the pool and the manager process are only started by the first submission
+        if self._pool is None:
+            self._manager = multiprocessing.Manager()
+            self._progress = self._manager.dict()
+            self._pool = ProcessPoolExecutor(max_workers=self.max_running)
+
+    def submit(self, task: Callable, *args, key: Optional[str] = None, name: Optional[str] = None,
+               on_done: Optional[Callable] = None, **kwargs) -> str:
+        """Queue task(context, *args, **kwargs) and return its job id
+
+        task must be a module-level function so it can be sent to a worker. on_done(result) runs in the
+        app's process when the job succeeds, e.g. to store the result in another cache.
+        """
+        with self._lock:
+            if key is not None and key in self._by_key:
+                existing = self._jobs.get(self._by_key[key])
+                if existing is not None and existing.state not in (FAILED, CANCELLED):
+                    return existing.job_id
+
+            pending = sum(job.state not in FINISHED_STATES for job in self._jobs.values())
+            if pending >= self.max_pending:
+                raise RuntimeError(f"{pending} jobs are already waiting, try again when some have finished")
+
+            self._start()
+            job = Job(uuid.uuid4().hex[:12], key, name or task.__name__, on_done)
+            job.cancel_event = self._manager.Event()
+            context = JobContext(job.job_id, self._progress, job.cancel_event)
+            self._jobs[job.job_id] = job
+            if key is not None:
+                self._by_key[key] = job.job_id
+            job.future = self._pool.submit(_run_job, task, context, args, kwargs)
+
+        job.future.add_done_callback(lambda future, job=job: self._finish(job, future))
+        return job.job_id
+
+    def _finish(self, job: Job, future):
+        try:
+            result = future.result()
+        except (CancelledError, JobCancelled):
+            state, result, error = CANCELLED, None, None
+        except Exception as e:
+            state, result, error = FAILED, None, f"{type(e).__name__}: {e}"
+        else:
+            # a job cancelled while inside an uninterruptible call still completes, its result is dropped
+            if job.cancel_event.is_set():
+                state, result, error = CANCELLED, None, None
+            else:
+                state, error = DONE, None
+
+        if state == DONE and job.on_done is not None:
+            try:
+                job.on_done(result)
+            except Exception as e:
+                state, error = FAILED, f"{type(e).__name__}: {e}"
+
+        with self._lock:
+            job.state, job.result, job.error = state, result, error
+            job.finished = time.time()
+            self._progress.pop(job.job_id, None)
+            self._evict()
+
+    def _evict(self):
+        finished = [job for job in self._jobs.values() if job.state in FINISHED_STATES]
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.job_id]
+            if job.key is not None and self._by_key.get(job.key) == job.job_id:
+                del self._by_key[job.key]
+
+    def find(self, key: str) -> Optional[str]:
+        """Id of the job submitted under key, if it is still known"""
+        with self._lock:
+            job_id = self._by_key.get(key)
+            return job_id if job_id in self._jobs else None
+
+    def status(self, job_id: str) -> Dict:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise KeyError(f"Unknown job {job_id}")
+            if job.state in FINISHED_STATES:
+                done, total = (1, 1) if job.state == DONE else (0, 0)
+            else:
+                done, total = self._progress.get(job_id, (0, 0))
+            state = job.state
+            # the worker reports (0, 0) as soon as it picks the job up
+            if state == QUEUED and job_id in self._progress:
+                state = job.state = RUNNING
+                job.started = time.time()
+            return {
+                'job_id': job.job_id,
+                'name': job.name,
+                'state': state,
+                'done': done,
+                'total': total,
+                'fraction': done / total if total else 0.0,
+                # a finished job no longer asks the manager process, which is gone after shutdown
+                'cancel_requested': job.state == CANCELLED if job.state in FINISHED_STATES else job.cancel_event.is_set(),
+                'elapsed': (job.finished or time.time()) - (job.started or job.submitted),
+                'error': job.error
+            }
+
+    def jobs(self) -> List[Dict]:
+        with self._lock:
+            job_ids = list(self._jobs)
+        return [self.status(job_id) for job_id in reversed(job_ids)]
+
+    def result(self, job_id: str):
+        """Result of a finished job, None while it is queued or running or when it did not succeed"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.result if job is not None and job.state == DONE else None
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a queued job, or ask a running one to stop at its next progress report"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in FINISHED_STATES:
+                return False
+            job.cancel_event.set()
+        # a job still in the pool's queue never starts, _finish marks it cancelled
+        job.future.cancel()
+        return True
+
+    def shutdown(self):
+        with self._lock:
+            for job in self._jobs.values():
+                if job.state not in FINISHED_STATES:
+                    job.cancel_event.set()
+            pool, manager = self._pool, self._manager
+        # waited for outside the lock, the done callbacks of the running jobs take it in _finish
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+            manager.shutdown()
+            with self._lock:
+                self._pool = self._manager = self._progress = None
+
+
+# tasks, run in the worker processes, context is always the first argument
+
+def align_task(context: JobContext, scoring: Dict, seq1: str, seq2: str, method: str = 'global', **options) -> Dict:
+    """BioPythonAligner.align_sequences, one uninterruptible step"""
+    context.progress(0, 1)
+    result = BioPythonAligner(**scoring).align_sequences(seq1, seq2, method, **options)
+    context.progress(1, 1)
+    return result
+
+
+def pairwise_task(context: JobContext, scoring: Dict, sequences: List[str], method: str = 'global',
+                  query: Optional[int] = None, score_only: bool = False) -> Dict:
+    """BioPythonAligner.pairwise_matrix inside the job's worker, progress after every chunk of pairs"""
+    return BioPythonAligner(**scoring).pairwise_matrix(
+        sequences, method, query=query, score_only=score_only, workers=1, progress=context.progress
+    )
+
+
+def motif_index_task(context: JobContext, records: List[Tuple[str, str]]) -> MotifIndex:
+    """MotifIndex.build over every (sequence_id, sequence), one uninterruptible step"""
+    context.progress(0, 1)
+    index = MotifIndex.build(Gene(sequence_id, '', sequence) for sequence_id, sequence in records)
+    context.progress(1, 1)
+    return index
+
+
+def sketch_task(context: JobContext, records: List[Tuple[str, str]]) -> MinHashSketches:
+    """MinHashSketches.build over every (sequence_id, sequence), one uninterruptible step"""
+    context.progress(0, 1)
+    sketches = MinHashSketches.build(Gene(sequence_id, '', sequence) for sequence_id, sequence in records)
+    context.progress(1, 1)
+    return sketches
+
+
+def approximate_motif_task(context: JobContext, records: List[Tuple[str, str, str]], motifs: List[str],
+                           max_errors: int, edits: bool = False) -> List[Dict]:
+    """Gene.find_approximate_motif of every motif in every (sequence_id, sequence, sequence_type), progress per search"""
+    rows = []
+    total = len(records) * len(motifs)
+    for i, (sequence_id, sequence, sequence_type) in enumerate(records):
+        gene = SEQUENCE_CLASSES[sequence_type](sequence_id, '', sequence)
+        for j, motif in enumerate(motifs):
+            context.progress(i * len(motifs) + j, total)
+            hits = gene.find_approximate_motif(motif, max_errors, edits=edits)
+            rows.append({
+                'sequence_id': sequence_id,
+                'motif': motif,
+                'strand': '+',
+                'occurrences': len(hits),
+                'positions': [start for start, _, _ in hits]
+            })
+    context.progress(total, total)
+    return rows
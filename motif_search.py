@@ -0,0 +1,308 @@
+import itertools
+import os
+import numpy as np
+import pandas as pd
+from collections import deque
+from typing import Dict, Iterable, List
+from gene_classes import IUPAC_CODES, Gene
+from instrumentation import instrumented
+from sequence_collection import SequenceCollection
+
+
+COMPLEMENT = str.maketrans('ACGTURYSWKMBDHVN', 'TGCAAYRSWMKVHDBN')
+
+# upper limit on concrete patterns a motif panel may expand to
+MAX_EXPANSIONS = 100_000
+
+# byte -> automaton symbol, U reads as T so RNA is searched too, 4 is anything that is not a base and matches nothing
+_SYMBOLS = bytearray([4]) * 256
+for _code, _base in enumerate(b'ACGT'):
+    _SYMBOLS[_base] = _SYMBOLS[_base + 32] = _code
+_SYMBOLS[ord('U')] = _SYMBOLS[ord('u')] = _SYMBOLS[ord('T')]
+_SYMBOLS = bytes(_SYMBOLS)
+_ALPHABET_SIZE = 5
+
+
+def reverse_complement(motif: str) -> str:
+    return motif.upper().translate(COMPLEMENT)[::-1]
+
+
+def expand_iupac(motif: str) -> List[str]:
+    """All concrete ACGT sequences a degenerate motif stands for"""
+    motif = motif.upper()
+    invalid = set(motif) - set(IUPAC_CODES)
+    if invalid:
+        raise ValueError(f"Invalid IUPAC symbols in motif '{motif}': {''.join(sorted(invalid))}")
+
+    n_expansions = np.prod([len(IUPAC_CODES[c]) for c in motif], dtype=np.float64)
+    if n_expansions > MAX_EXPANSIONS:
+        raise ValueError(f"Motif '{motif}' expands to more than {MAX_EXPANSIONS} sequences")
+
+    return [''.join(p) for p in itertools.product(*(IUPAC_CODES[c] for c in motif))]
+
+
+class MotifSearcher:
+    """Aho-Corasick automaton over a panel of IUPAC motifs and their reverse complements"""
+
+    def __init__(self, motifs: Iterable[str], both_strands: bool = True):
+        self.motifs = list(dict.fromkeys(m.upper() for m in motifs if m))
+        if not self.motifs:
+            raise ValueError("At least one motif is required")
+        self.strands = ['+', '-'] if both_strands else ['+']
+
+        # one label per (motif, strand), every concrete pattern points back to its label
+        self.labels = [(motif, strand) for motif in self.motifs for strand in self.strands]
+        patterns = []
+        for label, (motif, strand) in enumerate(self.labels):
+            oriented = motif if strand == '+' else reverse_complement(motif)
+            patterns.extend((p, label) for p in expand_iupac(oriented))
+        if len(patterns) > MAX_EXPANSIONS:
+            raise ValueError(f"Motif panel expands to more than {MAX_EXPANSIONS} sequences")
+
+        self._motif_lengths = np.array([len(motif) for motif, _ in self.labels], dtype=np.int64)
+        self._build(patterns)
+
+    def _build(self, patterns):
+        # trie
+        goto = [[-1] * _ALPHABET_SIZE]
+        outputs = [set()]
+        for pattern, label in patterns:
+            state = 0
+            for symbol in pattern.encode().translate(_SYMBOLS):
+                if goto[state][symbol] == -1:
+                    goto[state][symbol] = len(goto)
+                    goto.append([-1] * _ALPHABET_SIZE)
+                    outputs.append(set())
+                state = goto[state][symbol]
+            outputs[state].add(label)
+
+        # breadth-first pass turning the trie into a full DFA with merged outputs
+        fail = [0] * len(goto)
+        queue = deque()
+        for symbol in range(_ALPHABET_SIZE):
+            child = goto[0][symbol]
+            if child == -1:
+                goto[0][symbol] = 0
+            else:
+                queue.append(child)
+        while queue:
+            state = queue.popleft()
+            outputs[state] |= outputs[fail[state]]
+            for symbol in range(_ALPHABET_SIZE):
+                child = goto[state][symbol]
+                if child == -1:
+                    goto[state][symbol] = goto[fail[state]][symbol]
+                else:
+                    fail[child] = goto[fail[state]][symbol]
+                    queue.append(child)
+
+        # flat transition table holding row offsets, so the scan does one lookup per base
+        self._delta = [next_state * _ALPHABET_SIZE for row in goto for next_state in row]
+        self._outputs = [tuple(sorted(out)) if out else None for out in outputs]
+
+    def search(self, sequence: str) -> Dict[tuple, np.ndarray]:
+        """Start positions of every (motif, strand) in one pass over the sequence"""
+        delta = self._delta
+        outputs = self._outputs
+        hit_labels = []
+        hit_ends = []
+
+        state = 0
+        for position, symbol in enumerate(sequence.encode('ascii').translate(_SYMBOLS)):
+            state = delta[state + symbol]
+            out = outputs[state // _ALPHABET_SIZE]
+            if out is not None:
+                for label in out:
+                    hit_labels.append(label)
+                    hit_ends.append(position)
+
+        hit_labels = np.array(hit_labels, dtype=np.int64)
+        hit_starts = np.array(hit_ends, dtype=np.int64) - self._motif_lengths[hit_labels] + 1
+
+        # hits come out sorted by position, a stable sort keeps them sorted inside each label
+        order = np.argsort(hit_labels, kind='stable')
+        bounds = np.searchsorted(hit_labels[order], np.arange(len(self.labels) + 1))
+        return {
+            label: hit_starts[order[bounds[i]:bounds[i + 1]]]
+            for i, label in enumerate(self.labels)
+        }
+
+    @instrumented
+    def search_many(self, sequences: Iterable[Gene]) -> pd.DataFrame:
+        """Positions table with one row per sequence, motif and strand"""
+        rows = []
+        for gene in sequences:
+            for (motif, strand), positions in self.search(gene.sequence).items():
+                rows.append({
+                    'sequence_id': gene.sequence_id,
+                    'motif': motif,
+                    'strand': strand,
+                    'occurrences': len(positions),
+                    'positions': positions
+                })
+        return pd.DataFrame(rows, columns=['sequence_id', 'motif', 'strand', 'occurrences', 'positions'])
+
+
+def _suffix_array(text: np.ndarray) -> np.ndarray:
+    """Suffix array by prefix doubling, each round is one vectorized sort"""
+    n = len(text)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    rank = np.unique(text, return_inverse=True)[1].astype(np.int64)
+    step = 1
+    while True:
+        # suffixes running off the end sort before any other
+        second = np.zeros(n, dtype=np.int64)
+        second[:max(n - step, 0)] = rank[step:] + 1
+        key = rank * (n + 1) + second
+
+        suffix_array = np.argsort(key, kind='stable')
+        sorted_key = key[suffix_array]
+        rank = np.empty(n, dtype=np.int64)
+        rank[suffix_array] = np.concatenate([[0], np.cumsum(sorted_key[1:] != sorted_key[:-1])])
+
+        if rank[suffix_array[-1]] == n - 1 or step >= n:
+            return suffix_array
+        step *= 2
+
+
+class MotifIndex:
+    """Suffix array over a whole dataset, built once and queried in O(motif length * log n + hits)"""
+
+    SEPARATOR = b'$'
+
+    def __init__(self, text: np.ndarray, suffix_array: np.ndarray, starts: np.ndarray, sequence_ids: List[str]):
+        # only the bytes are kept, the binary searches compare slices of them
+        self._text_bytes = text.tobytes()
+        self._suffix_array = suffix_array
+        self._starts = starts
+        self.sequence_ids = list(sequence_ids)
+        self._positions = {sequence_id: i for i, sequence_id in enumerate(self.sequence_ids)}
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the index"""
+        return len(self._text_bytes) + self._suffix_array.nbytes + self._starts.nbytes
+
+    @classmethod
+    @instrumented
+    def build(cls, sequences: Iterable[Gene]) -> 'MotifIndex':
+        # a collection hands over its raw sequences without building an object per record
+        if isinstance(sequences, SequenceCollection):
+            sequence_ids = sequences.sequence_ids
+            chunks = [sequence.upper().encode('ascii') for sequence in sequences.sequences]
+        else:
+            sequence_ids = []
+            chunks = []
+            for gene in sequences:
+                sequence_ids.append(gene.sequence_id)
+                chunks.append(gene.sequence.upper().encode('ascii'))
+
+        # records are joined with a separator no motif can match across
+        text = np.frombuffer(cls.SEPARATOR.join(chunks) + cls.SEPARATOR, dtype=np.uint8)
+        lengths = np.array([len(chunk) + 1 for chunk in chunks], dtype=np.int64)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+
+        suffix_array = _suffix_array(text)
+        if len(text) < np.iinfo(np.int32).max:
+            suffix_array = suffix_array.astype(np.int32)
+        return cls(text, suffix_array, starts, sequence_ids)
+
+    def save(self, path):
+        np.savez(
+            path,
+            text=np.frombuffer(self._text_bytes, dtype=np.uint8),
+            suffix_array=self._suffix_array,
+            starts=self._starts,
+            sequence_ids=np.array(self.sequence_ids, dtype=str)
+        )
+
+    @classmethod
+    def load(cls, path) -> 'MotifIndex':
+        with np.load(path) as data:
+            return cls(data['text'], data['suffix_array'], data['starts'], data['sequence_ids'].tolist())
+
+    @classmethod
+    def from_fasta(cls, file_path, persist: bool = True) -> 'MotifIndex':
+        """Load the index saved next to a FASTA file, rebuilding it when the file is newer"""
+        from fasta_parser import FastaParser
+
+        index_path = f"{file_path}.sai.npz"
+        if os.path.exists(index_path) and os.path.getmtime(index_path) >= os.path.getmtime(file_path):
+            return cls.load(index_path)
+
+        index = cls.build(FastaParser.create_sequence_objects(file_path))
+        if persist:
+            index.save(index_path)
+        return index
+
+    def _suffix_range(self, pattern: bytes) -> tuple:
+        text = self._text_bytes
+        suffix_array = self._suffix_array
+        m = len(pattern)
+
+        low, high = 0, len(suffix_array)
+        while low < high:
+            mid = (low + high) // 2
+            start = suffix_array[mid]
+            if text[start:start + m] < pattern:
+                low = mid + 1
+            else:
+                high = mid
+        first = low
+
+        high = len(suffix_array)
+        while low < high:
+            mid = (low + high) // 2
+            start = suffix_array[mid]
+            if text[start:start + m] <= pattern:
+                low = mid + 1
+            else:
+                high = mid
+        return first, low
+
+    @instrumented
+    def query(self, motif: str) -> tuple:
+        """Record numbers and start positions of every occurrence of an IUPAC motif"""
+        hits = [
+            self._suffix_array[slice(*self._suffix_range(pattern.encode()))]
+            for pattern in expand_iupac(motif)
+        ]
+        hits = np.sort(np.concatenate(hits).astype(np.int64)) if hits else np.zeros(0, dtype=np.int64)
+        records = np.searchsorted(self._starts, hits, side='right') - 1
+        return records, hits - self._starts[records]
+
+    @instrumented
+    def search_many(self, motifs: Iterable[str], sequence_ids: Iterable[str] = None,
+                    both_strands: bool = True) -> pd.DataFrame:
+        """Same positions table as MotifSearcher.search_many, answered from the index"""
+        sequence_ids = self.sequence_ids if sequence_ids is None else list(sequence_ids)
+        wanted = np.array([self._positions[sequence_id] for sequence_id in sequence_ids], dtype=np.int64)
+        strands = ['+', '-'] if both_strands else ['+']
+
+        motifs = list(dict.fromkeys(m.upper() for m in motifs if m))
+        hits = {}
+        for motif in motifs:
+            for strand in strands:
+                records, positions = self.query(motif if strand == '+' else reverse_complement(motif))
+                # hits are sorted by position, a stable sort groups them by record
+                order = np.argsort(records, kind='stable')
+                first = np.searchsorted(records[order], wanted, side='left')
+                last = np.searchsorted(records[order], wanted, side='right')
+                for i, sequence_id in enumerate(sequence_ids):
+                    hits[(sequence_id, motif, strand)] = positions[order[first[i]:last[i]]]
+
+        rows = [
+            {
+                'sequence_id': sequence_id,
+                'motif': motif,
+                'strand': strand,
+                'occurrences': len(hits[(sequence_id, motif, strand)]),
+                'positions': hits[(sequence_id, motif, strand)]
+            }
+            for sequence_id in sequence_ids
+            for motif in motifs
+            for strand in strands
+        ]
+        return pd.DataFrame(rows, columns=['sequence_id', 'motif', 'strand', 'occurrences', 'positions'])
@@ -1,8 +1,335 @@
-import pandas as pd 
-from gene_classes import Gene
-
-
-# Main execution
-file_path = "mtDNA_dataset.txt"
-df = build_dataframe_from_file(file_path)
-print(df)
\ No newline at end of file
+"""Headless batch analysis of FASTA files, the command-line counterpart of the Streamlit app
+
+    python project.py mtDNA_dataset.txt archive/ -o results.csv --motif GATTACA --motif TATAAA
+    python project.py genomes/ -o results.parquet --reference reference.fasta:NC_012920 --workers 8
+
+Records are streamed in batches, each batch is analysed in a worker process (composition, GC content,
+motif counts and optionally an alignment against a reference) and its rows are appended to the output as
+soon as they are ready. At most two batches per worker are in flight, so memory stays bounded by the batch
+size whatever the size of the input.
+"""
+import argparse
+import os
+import sys
+import numpy as np
+import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+from fasta_parser import FastaParser
+from composition import DNA_ALPHABET, RNA_ALPHABET, PROTEIN_ALPHABET, composition_table
+from gene_classes import IUPAC_CODES, BioPythonAligner, Gene, classify_sequence
+from motif_search import MotifSearcher
+
+
+FASTA_EXTENSIONS = ('.fasta', '.fa', '.fna', '.ffn', '.faa', '.fas', '.txt')
+COMPRESSED_EXTENSIONS = ('.gz', '.bgz')
+
+# every symbol any alphabet counts, so all batches share one set of columns
+COUNT_SYMBOLS = list(dict.fromkeys(DNA_ALPHABET + RNA_ALPHABET + PROTEIN_ALPHABET)) + ['ambiguous']
+
+ALIGNMENT_COLUMNS = ['alignment_score', 'percent_identity', 'gaps']
+
+# records whose alignment would fill more DP cells than this get empty alignment columns
+MAX_ALIGNMENT_CELLS = 100_000_000
+
+# per-process analysis settings, set once by _init_worker instead of being sent with every batch
+_worker = {}
+
+
+def iter_fasta_files(paths: List[str]) -> Iterator[str]:
+    """The given files, and every FASTA file under the given directories in name order"""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, directories, files in os.walk(path):
+            directories.sort()
+            for name in sorted(files):
+                stem, extension = os.path.splitext(name)
+                if extension.lower() not in COMPRESSED_EXTENSIONS:
+                    stem = name
+                if stem.lower().endswith(FASTA_EXTENSIONS):
+                    yield os.path.join(root, name)
+
+
+def output_columns(motifs: List[str], align: bool) -> List[str]:
+    columns = ['source', 'sequence_id', 'sequence_description', 'sequence_type', 'invalid_symbols', 'length']
+    columns += [f'{symbol}_count' for symbol in COUNT_SYMBOLS]
+    columns += ['GC_content_percentage']
+    columns += [f'motif_{motif}' for motif in motifs]
+    if align:
+        columns += ALIGNMENT_COLUMNS
+    return columns
+
+
+def nucleotide_motifs(motifs: List[str]) -> List[str]:
+    """The motifs made of IUPAC codes, the others (e.g. LLE) can only be counted in protein records"""
+    return [motif for motif in motifs if set(motif) <= set(IUPAC_CODES)]
+
+
+def check_motifs(motifs: List[str]) -> List[str]:
+    """Upper-cased motifs without duplicates, raises ValueError before any output is written when one cannot be searched"""
+    motifs = list(dict.fromkeys(motif.upper() for motif in motifs if motif))
+    if nucleotide_motifs(motifs):
+        MotifSearcher(nucleotide_motifs(motifs))
+    return motifs
+
+
+def _init_worker(motifs: List[str], both_strands: bool, reference: Optional[str], method: str,
+                 score_only: bool, scoring: Dict, max_cells: Optional[int]):
+    _worker['motifs'] = motifs
+    _worker['both_strands'] = both_strands
+    _worker['searcher'] = None
+    _worker['reference'] = reference
+    _worker['reference_type'] = classify_sequence(reference)[0] if reference else None
+    _worker['aligner'] = BioPythonAligner(**scoring)
+    _worker['method'] = method
+    _worker['score_only'] = score_only
+    _worker['max_cells'] = max_cells
+
+
+def _motif_counts(sequence: str, sequence_type: str) -> List[int]:
+    motifs = _worker['motifs']
+    if sequence_type == "protein":
+        # IUPAC expansion and strands only mean something for nucleotides
+        return [len(Gene('', '', sequence).find_motif(motif)) for motif in motifs]
+    searchable = nucleotide_motifs(motifs)
+    if not searchable:
+        return [np.nan] * len(motifs)
+    # the automaton handles IUPAC codes and reverse complements, it is built once per process
+    if _worker['searcher'] is None:
+        _worker['searcher'] = MotifSearcher(searchable, _worker['both_strands'])
+    hits = _worker['searcher'].search(sequence.upper())
+    # a motif outside the IUPAC codes has no count in a nucleotide record
+    return [
+        sum(len(positions) for (motif, _), positions in hits.items() if motif == m) if m in searchable else np.nan
+        for m in motifs
+    ]
+
+
+def _alignment(sequence: str, sequence_type: str) -> List[float]:
+    reference = _worker['reference']
+    # a protein is never aligned against a nucleotide reference, or the other way round
+    if (sequence_type == "protein") != (_worker['reference_type'] == "protein") or not sequence:
+        return [np.nan] * len(ALIGNMENT_COLUMNS)
+    aligner = _worker['aligner']
+    max_cells = _worker['max_cells']
+    if _worker['score_only']:
+        # the score alone is a full DP over the pair, linear in memory but not in time
+        if max_cells is not None and len(reference) * len(sequence) > max_cells:
+            return [np.nan] * len(ALIGNMENT_COLUMNS)
+        return [aligner.score_sequences(reference, sequence, _worker['method']), np.nan, np.nan]
+    try:
+        result = aligner.align_sequences(reference, sequence, _worker['method'], max_cells=max_cells)
+    except ValueError:
+        # over the DP budget, e.g. a seeded pair sharing no anchors
+        return [np.nan] * len(ALIGNMENT_COLUMNS)
+    return [result['score'], result['percent_identity'], result['gaps']]
+
+
+def analyze_batch(source: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Result rows for one batch of records, run inside a worker"""
+    # composition_table counts every record against its own alphabet, mixed files included
+    table = composition_table(df)
+    counts = table.reindex(columns=COUNT_SYMBOLS, fill_value=0)
+    gc_content = table.get('GC_content_percentage', pd.Series(np.nan, index=df.index))
+
+    rows = pd.DataFrame({
+        'source': source,
+        'sequence_id': df.index,
+        'sequence_description': df['sequence_description'].to_numpy(),
+        'sequence_type': df['sequence_type'].to_numpy(),
+        'invalid_symbols': df['invalid_symbols'].to_numpy(),
+        'length': df['sequence'].str.len().to_numpy()
+    })
+    for symbol in COUNT_SYMBOLS:
+        rows[f'{symbol}_count'] = counts[symbol].to_numpy()
+    rows['GC_content_percentage'] = gc_content.to_numpy()
+
+    if _worker['motifs']:
+        motif_counts = np.array([
+            _motif_counts(sequence, sequence_type)
+            for sequence, sequence_type in zip(df['sequence'], df['sequence_type'])
+        ], dtype=np.float64).reshape(len(df), len(_worker['motifs']))
+        searchable = nucleotide_motifs(_worker['motifs'])
+        for i, motif in enumerate(_worker['motifs']):
+            # counts stay integers unless the motif can be NaN, every batch gets the same column types
+            counts = motif_counts[:, i]
+            rows[f'motif_{motif}'] = counts.astype(np.int64) if motif in searchable else counts
+
+    if _worker['reference'] is not None:
+        alignments = np.array([
+            _alignment(sequence, sequence_type)
+            for sequence, sequence_type in zip(df['sequence'], df['sequence_type'])
+        ], dtype=np.float64).reshape(len(df), len(ALIGNMENT_COLUMNS))
+        for i, column in enumerate(ALIGNMENT_COLUMNS):
+            rows[column] = alignments[:, i]
+
+    return rows
+
+
+class CsvOutput:
+    def __init__(self, path, columns: List[str]):
+        self.path = path
+        self.columns = columns
+        self._header = True
+        # an existing file is replaced, batches are then appended as they arrive
+        open(path, 'w').close()
+
+    def write(self, rows: pd.DataFrame):
+        rows[self.columns].to_csv(self.path, mode='a', header=self._header, index=False)
+        self._header = False
+
+    def close(self):
+        pass
+
+
+class ParquetOutput:
+    """One row group per batch, written with pyarrow's ParquetWriter"""
+
+    def __init__(self, path, columns: List[str]):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output needs pyarrow, install it or write a .csv file instead")
+        self._pa = pa
+        self.columns = columns
+        self._path = path
+        self._parquet = pq
+        self._writer = None
+
+    def write(self, rows: pd.DataFrame):
+        table = self._pa.Table.from_pandas(rows[self.columns], preserve_index=False)
+        if self._writer is None:
+            # the first batch fixes the schema, later ones are cast to it
+            self._writer = self._parquet.ParquetWriter(self._path, table.schema)
+        self._writer.write_table(table.cast(self._writer.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def open_output(path, columns: List[str], output_format: Optional[str] = None):
+    output_format = output_format or ('parquet' if path.lower().endswith(('.parquet', '.pq')) else 'csv')
+    if output_format == 'parquet':
+        return ParquetOutput(path, columns)
+    return CsvOutput(path, columns)
+
+
+def load_reference(spec: str) -> str:
+    """'file.fasta' for its first record, 'file.fasta:ID' for a given record (read through the .fai index)"""
+    path, _, sequence_id = spec.partition(':')
+    if not os.path.exists(path) and os.path.exists(spec):
+        path, sequence_id = spec, ''
+    if sequence_id:
+        return FastaParser.fetch(path, sequence_id)
+    for record in FastaParser.iter_records(path):
+        return record['sequence']
+    raise ValueError(f"{path} contains no records")
+
+
+def run(paths: List[str], output, motifs: List[str] = (), both_strands: bool = True, reference: Optional[str] = None,
+        method: str = 'seeded', score_only: bool = False, scoring: Optional[Dict] = None, workers: Optional[int] = None,
+        batch_size: int = 200, output_format: Optional[str] = None, progress=None,
+        max_cells: Optional[int] = MAX_ALIGNMENT_CELLS) -> int:
+    """Analyse every record of every input and write one row per record to output, returns the record count"""
+    motifs = check_motifs(motifs)
+    reference_sequence = load_reference(reference) if reference else None
+    init_args = (motifs, both_strands, reference_sequence, method, score_only,
+                 scoring or BioPythonAligner().scoring(), max_cells)
+    writer = open_output(output, output_columns(motifs, reference is not None), output_format)
+    workers = workers or os.cpu_count() or 1
+    written = 0
+
+    def batches():
+        for path in iter_fasta_files(paths):
+            for df in FastaParser.iter_dataframes(path, batch_size):
+                yield path, df
+
+    try:
+        if workers == 1:
+            _init_worker(*init_args)
+            for source, df in batches():
+                rows = analyze_batch(source, df)
+                writer.write(rows)
+                written += len(rows)
+                if progress:
+                    progress(written)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=init_args) as pool:
+                # batches are written in input order, and never more than two per worker wait in memory
+                pending = deque()
+                for source, df in batches():
+                    pending.append(pool.submit(analyze_batch, source, df))
+                    if len(pending) >= 2 * workers:
+                        rows = pending.popleft().result()
+                        writer.write(rows)
+                        written += len(rows)
+                        if progress:
+                            progress(written)
+                while pending:
+                    rows = pending.popleft().result()
+                    writer.write(rows)
+                    written += len(rows)
+                    if progress:
+                        progress(written)
+    finally:
+        writer.close()
+    return written
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Batch composition, GC, motif and alignment analysis of FASTA files")
+    parser.add_argument('inputs', nargs='+', help="FASTA files (plain, gzip or BGZF) or directories to search for them")
+    parser.add_argument('-o', '--output', required=True, help="result table, .csv or .parquet")
+    parser.add_argument('--format', choices=['csv', 'parquet'], help="output format when the extension does not say")
+    parser.add_argument('-m', '--motif', action='append', default=[],
+                        help="motif to count, IUPAC codes allowed, repeatable. A motif with other symbols is only "
+                             "counted in protein records and left empty in nucleotide ones")
+    parser.add_argument('--forward-only', action='store_true', help="count nucleotide motifs on the forward strand only")
+    parser.add_argument('-r', '--reference', help="align every record against FILE or FILE:SEQUENCE_ID")
+    parser.add_argument('--method', choices=['global', 'local', 'seeded'], default='seeded',
+                        help="alignment method (default seeded): DP only between exact k-mer anchors, fast for "
+                             "similar genomes, a full DP for pairs sharing no anchors")
+    parser.add_argument('--max-cells', type=int, default=MAX_ALIGNMENT_CELLS,
+                        help="leave the alignment columns empty for records whose DP would fill more cells, 0 for no limit")
+    parser.add_argument('--score-only', action='store_true', help="report the alignment score only, without a traceback")
+    parser.add_argument('--match-score', type=float, default=2)
+    parser.add_argument('--mismatch-score', type=float, default=-1)
+    parser.add_argument('--open-gap-score', type=float, default=-0.5)
+    parser.add_argument('--extend-gap-score', type=float, default=-0.1)
+    parser.add_argument('-w', '--workers', type=int, help="worker processes, all cores by default")
+    parser.add_argument('-b', '--batch-size', type=int, default=200, help="records per batch, bounds memory per worker")
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    scoring = BioPythonAligner(args.match_score, args.mismatch_score, args.open_gap_score, args.extend_gap_score).scoring()
+    progress = None if args.quiet else lambda n: print(f"\r{n:,} records", end='', file=sys.stderr, flush=True)
+    try:
+        motifs = check_motifs(args.motif)
+    except ValueError as e:
+        parser.error(str(e))
+    written = run(
+        args.inputs, args.output,
+        motifs=motifs,
+        both_strands=not args.forward_only,
+        reference=args.reference,
+        method=args.method,
+        score_only=args.score_only,
+        scoring=scoring,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        output_format=args.format,
+        progress=progress,
+        max_cells=args.max_cells or None
+    )
+    if not args.quiet:
+        print(f"\r{written:,} records written to {args.output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Union
+from columnar_format import ColumnarDataset
+from gene_classes import SEQUENCE_CLASSES, Gene, classify_sequence
+
+
+class SequenceCollection:
+    """Parsed records with O(1) lookup by id, sequence objects are only built when accessed
+
+    Backed by a DataFrame from FastaParser.parse_file or a memory-mapped ColumnarDataset. Slicing
+    returns another collection over the same data, nothing is copied.
+    """
+
+    # sequence objects kept alive per collection
+    MAX_CACHED_OBJECTS = 1024
+
+    def __init__(self, data: Union[pd.DataFrame, ColumnarDataset], sequence_type: str,
+                 positions: Optional[np.ndarray] = None):
+        self._data = data
+        if isinstance(data, pd.DataFrame):
+            self._all_ids = data.index
+        else:
+            self._all_ids = pd.Index(data.sequence_ids)
+        self._positions = np.arange(len(self._all_ids)) if positions is None else positions
+        self._ids = self._all_ids[self._positions]
+        self.sequence_type = sequence_type
+        self._objects = OrderedDict()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __iter__(self) -> Iterator[Gene]:
+        for i in range(len(self)):
+            yield self._object(i)
+
+    def __contains__(self, sequence_id: str):
+        return sequence_id in self._ids
+
+    def __getitem__(self, key) -> Union[Gene, 'SequenceCollection']:
+        """collection['NC_000001'] by id, collection[3] by position, collection[10:20] for a sub-collection"""
+        if isinstance(key, slice):
+            return self._subset(self._positions[key])
+        if isinstance(key, (int, np.integer)):
+            return self._object(range(len(self))[key])
+        return self._object(self._position_of(key))
+
+    def get(self, sequence_id: str, default=None) -> Optional[Gene]:
+        return self[sequence_id] if sequence_id in self._ids else default
+
+    def select(self, sequence_ids: List[str]) -> 'SequenceCollection':
+        """Sub-collection with the given ids, in the given order"""
+        return self._subset(self._positions[[self._position_of(sequence_id) for sequence_id in sequence_ids]])
+
+    @property
+    def sequence_ids(self) -> List[str]:
+        return self._ids.tolist()
+
+    @property
+    def descriptions(self) -> pd.Series:
+        if isinstance(self._data, pd.DataFrame):
+            values = self._data['sequence_description'].to_numpy()[self._positions]
+        else:
+            values = [self._data.description(i) for i in self._positions]
+        return pd.Series(values, index=self._ids, name='sequence_description')
+
+    @property
+    def sequences(self) -> pd.Series:
+        if isinstance(self._data, pd.DataFrame):
+            values = self._data['sequence'].to_numpy()[self._positions]
+        else:
+            values = [self._data.sequence(i) for i in self._positions]
+        return pd.Series(values, index=self._ids, name='sequence')
+
+    @property
+    def lengths(self) -> pd.Series:
+        if isinstance(self._data, pd.DataFrame):
+            values = self._data['sequence'].str.len().to_numpy()[self._positions]
+        else:
+            values = self._data.lengths[self._positions]
+        return pd.Series(values, index=self._ids, name='length')
+
+    @property
+    def sequence_types(self) -> pd.Series:
+        """Type of every record, a mixed file holds more than one"""
+        if isinstance(self._data, pd.DataFrame) and 'sequence_type' in self._data:
+            values = self._data['sequence_type'].to_numpy()[self._positions]
+        else:
+            values = [self._record_type(row) for row in self._positions]
+        return pd.Series(values, index=self._ids, name='sequence_type')
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """The records as a FastaParser.parse_file DataFrame"""
+        if isinstance(self._data, pd.DataFrame):
+            return self._data.iloc[self._positions]
+        classes = [classify_sequence(self._data.sequence_bytes(row)) for row in self._positions]
+        return pd.DataFrame({
+            'sequence_description': self.descriptions,
+            'sequence': self.sequences,
+            'sequence_type': [sequence_type for sequence_type, _ in classes],
+            'invalid_symbols': [invalid_symbols for _, invalid_symbols in classes]
+        })
+
+    def _subset(self, positions: np.ndarray) -> 'SequenceCollection':
+        return SequenceCollection(self._data, self.sequence_type, positions)
+
+    def _position_of(self, sequence_id: str) -> int:
+        # the index hash table is built once, every later lookup is O(1)
+        location = self._ids.get_loc(sequence_id)
+        if isinstance(location, slice):
+            return location.start
+        if isinstance(location, np.ndarray):
+            return int(np.flatnonzero(location)[0])
+        return location
+
+    def _raw_sequence(self, row: int) -> str:
+        if isinstance(self._data, pd.DataFrame):
+            return self._data['sequence'].iat[row]
+        return self._data.sequence(row)
+
+    def _raw_description(self, row: int) -> str:
+        if isinstance(self._data, pd.DataFrame):
+            return self._data['sequence_description'].iat[row]
+        return self._data.description(row)
+
+    def _record_type(self, row: int) -> str:
+        # every record gets the class of its own alphabet, mixed files included
+        if isinstance(self._data, pd.DataFrame):
+            if 'sequence_type' in self._data:
+                return self._data['sequence_type'].iat[row]
+            return classify_sequence(self._data['sequence'].iat[row])[0]
+        return classify_sequence(self._data.sequence_bytes(row))[0]
+
+    def _object(self, i: int) -> Gene:
+        row = int(self._positions[i])
+        obj = self._objects.get(row)
+        if obj is None:
+            obj = SEQUENCE_CLASSES[self._record_type(row)](
+                sequence_id=self._all_ids[row],
+                sequence_description=self._raw_description(row),
+                sequence=self._raw_sequence(row)
+            )
+            self._objects[row] = obj
+            if len(self._objects) > self.MAX_CACHED_OBJECTS:
+                self._objects.popitem(last=False)
+        else:
+            self._objects.move_to_end(row)
+        return obj
+
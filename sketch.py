@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+from typing import Iterable, List
+from gene_classes import Gene, _kmer_codes
+from instrumentation import instrumented
+from sequence_collection import SequenceCollection
+
+
+_COMPLEMENT = str.maketrans('ACGT', 'TGCA')
+
+# cells of the dense sequence x hash block used to count shared hashes, bounds the memory of shared_counts
+BLOCK_CELLS = 1 << 24
+
+
+def _hash64(values: np.ndarray) -> np.ndarray:
+    #splitmix64 finalizer, spreads 2-bit k-mer codes uniformly over 64 bits
+    x = values.astype(np.uint64)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def canonical_kmer_hashes(sequence: str, k: int) -> np.ndarray:
+    """Sorted unique hashes of the canonical k-mers (the smaller of a k-mer and its reverse complement)"""
+    sequence = sequence.upper()
+    forward, valid = _kmer_codes(sequence, k)
+    # the reverse complement's k-mers, read backwards, line up with the forward ones
+    reverse, _ = _kmer_codes(sequence.translate(_COMPLEMENT)[::-1], k)
+    return np.unique(_hash64(np.minimum(forward, reverse[::-1])[valid]))
+
+
+def mash_distance(jaccard, k: int):
+    """Mash distance -1/k * ln(2J / (1 + J)), an estimate of the per-base divergence, 1 when nothing is shared"""
+    jaccard = np.asarray(jaccard, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        # + 0.0 turns the -0.0 of identical sets into 0.0
+        distance = -np.log(2 * jaccard / (1 + jaccard)) / k + 0.0
+    return np.minimum(distance, 1.0)
+
+
+class MinHashSketches:
+    """FracMinHash sketches of a dataset: every canonical k-mer hash below 2**64 / scaled is kept
+
+    A sketch is about 1/scaled of a sequence's distinct k-mers. Because every sketch uses the same
+    threshold, the Jaccard index of two sequences is estimated directly from their sketches, and all pairs
+    are compared at once. Sketches are stored as one sorted uint64 array per sequence, concatenated.
+    """
+
+    def __init__(self, hashes: np.ndarray, offsets: np.ndarray, sequence_ids: List[str], k: int, scaled: int):
+        self._hashes = hashes
+        self._offsets = offsets
+        self.sequence_ids = list(sequence_ids)
+        self.k = k
+        self.scaled = scaled
+        self._positions = {sequence_id: i for i, sequence_id in enumerate(self.sequence_ids)}
+
+    @classmethod
+    @instrumented
+    def build(cls, sequences: Iterable[Gene], k: int = 21, scaled: int = 50) -> 'MinHashSketches':
+        if not 1 <= k <= 32:
+            raise ValueError("k must be between 1 and 32")
+        if scaled < 1:
+            raise ValueError("scaled must be at least 1")
+
+        if isinstance(sequences, SequenceCollection):
+            sequence_ids, raw = sequences.sequence_ids, sequences.sequences.tolist()
+        else:
+            sequences = list(sequences)
+            sequence_ids = [gene.sequence_id for gene in sequences]
+            raw = [gene.sequence for gene in sequences]
+
+        threshold = np.uint64((2 ** 64 - 1) // scaled)
+        sketches = []
+        for sequence in raw:
+            hashes = canonical_kmer_hashes(sequence, k)
+            sketches.append(hashes[hashes <= threshold])
+
+        offsets = np.concatenate([[0], np.cumsum([len(sketch) for sketch in sketches])]).astype(np.int64)
+        hashes = np.concatenate(sketches) if sketches else np.zeros(0, dtype=np.uint64)
+        return cls(hashes.astype(np.uint64), offsets, sequence_ids, k, scaled)
+
+    def __len__(self):
+        return len(self.sequence_ids)
+
+    def sketch(self, sequence_id: str) -> np.ndarray:
+        i = self._positions[sequence_id]
+        return self._hashes[self._offsets[i]:self._offsets[i + 1]]
+
+    @property
+    def sizes(self) -> np.ndarray:
+        return np.diff(self._offsets)
+
+    @property
+    def nbytes(self) -> int:
+        return self._hashes.nbytes + self._offsets.nbytes
+
+    def save(self, path):
+        np.savez(
+            path,
+            hashes=self._hashes,
+            offsets=self._offsets,
+            sequence_ids=np.array(self.sequence_ids, dtype=str),
+            parameters=np.array([self.k, self.scaled], dtype=np.int64)
+        )
+
+    @classmethod
+    def load(cls, path) -> 'MinHashSketches':
+        with np.load(path) as data:
+            k, scaled = data['parameters'].tolist()
+            return cls(data['hashes'], data['offsets'], data['sequence_ids'].tolist(), k, scaled)
+
+    def _owners(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.sizes)
+
+    @instrumented
+    def shared_counts(self) -> np.ndarray:
+        """n x n matrix of the hashes every two sketches share, one matrix product per block of hashes"""
+        n = len(self)
+        columns, column_of = np.unique(self._hashes, return_inverse=True)
+        owners = self._owners()
+        shared = np.zeros((n, n), dtype=np.float64)
+        block = max(1, BLOCK_CELLS // max(n, 1))
+
+        order = np.argsort(column_of, kind='stable')
+        column_of, owners = column_of[order], owners[order]
+        bounds = np.searchsorted(column_of, np.arange(0, len(columns) + block, block))
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            if first == last:
+                continue
+            base = column_of[first]
+            incidence = np.zeros((n, column_of[last - 1] - base + 1), dtype=np.float32)
+            incidence[owners[first:last], column_of[first:last] - base] = 1
+            shared += incidence @ incidence.T
+        return shared.astype(np.int64)
+
+    def jaccard_matrix(self) -> pd.DataFrame:
+        """Estimated Jaccard index of the k-mer sets of every pair of sequences"""
+        shared = self.shared_counts()
+        sizes = self.sizes
+        union = sizes[:, None] + sizes[None, :] - shared
+        with np.errstate(invalid='ignore', divide='ignore'):
+            jaccard = np.where(union > 0, shared / union, 0.0)
+        return pd.DataFrame(jaccard, index=self.sequence_ids, columns=self.sequence_ids)
+
+    def distance_matrix(self) -> pd.DataFrame:
+        """Mash distance of every pair of sequences"""
+        jaccard = self.jaccard_matrix()
+        return pd.DataFrame(mash_distance(jaccard.to_numpy(), self.k), index=jaccard.index, columns=jaccard.columns)
+
+    @instrumented
+    def nearest(self, sequence_id: str, top: int = 5) -> pd.DataFrame:
+        """The top sequences closest to sequence_id, most similar first"""
+        query = self.sketch(sequence_id)
+        shared = np.bincount(self._owners()[np.isin(self._hashes, query)], minlength=len(self))
+        union = self.sizes + len(query) - shared
+        with np.errstate(invalid='ignore', divide='ignore'):
+            jaccard = np.where(union > 0, shared / union, 0.0)
+
+        others = np.array([i for i in range(len(self)) if i != self._positions[sequence_id]], dtype=np.int64)
+        best = others[np.argsort(-jaccard[others], kind='stable')[:top]]
+        return pd.DataFrame({
+            'sequence_id': [self.sequence_ids[i] for i in best],
+            'shared_hashes': shared[best],
+            'jaccard': jaccard[best],
+            'mash_distance': mash_distance(jaccard[best], self.k)
+        })
+
+    def candidate_pairs(self, top: int = 5, max_distance: float = 1.0) -> pd.DataFrame:
+        """Every sequence paired with its top nearest neighbours, each pair once, closest first
+
+        These are the pairs worth a full alignment, the rest of the all-pairs matrix can be skipped.
+        """
+        jaccard = self.jaccard_matrix().to_numpy().copy()
+        np.fill_diagonal(jaccard, -1)
+        neighbours = np.argsort(-jaccard, axis=1, kind='stable')[:, :top]
+        first = np.repeat(np.arange(len(self)), neighbours.shape[1])
+        second = neighbours.ravel()
+        pairs = np.unique(np.sort(np.stack([first, second], axis=1), axis=1), axis=0)
+        if len(pairs) == 0:
+            return pd.DataFrame(columns=['sequence_id_1', 'sequence_id_2', 'jaccard', 'mash_distance'])
+
+        values = jaccard[pairs[:, 0], pairs[:, 1]]
+        table = pd.DataFrame({
+            'sequence_id_1': [self.sequence_ids[i] for i in pairs[:, 0]],
+            'sequence_id_2': [self.sequence_ids[j] for j in pairs[:, 1]],
+            'jaccard': values,
+            'mash_distance': mash_distance(values, self.k)
+        })
+        table = table[table['mash_distance'] <= max_distance]
+        return table.sort_values('mash_distance', kind='stable').reset_index(drop=True)